@@ -0,0 +1,87 @@
+# bench_db.py
+# Вставки в download_history: старый способ (connect/commit/close на каждую
+# строку) против общего WAL-соединения с буфером.
+#
+#   python bench/bench_db.py [--rows 2000]
+#
+# "caller" — сколько времени вызов занимает у вызывающего (то есть у event
+# loop), "total" — пока все строки реально не окажутся в базе.
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def old_add_download_to_history(user_id, video_title, video_url, file_path):
+    # Реализация до перехода на общее соединение
+    conn = sqlite3.connect("users.db")
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO download_history (user_id, video_title, video_url, file_path, download_date)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, video_title, video_url, file_path, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    conn.commit()
+    conn.close()
+
+
+def count_rows():
+    conn = sqlite3.connect("users.db")
+    count = conn.execute("SELECT COUNT(*) FROM download_history").fetchone()[0]
+    conn.close()
+    return count
+
+
+def bench_old(rows):
+    started = time.perf_counter()
+    for i in range(rows):
+        old_add_download_to_history(i % 50, f"title {i}", f"https://youtu.be/{i:011d}", "mp3")
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed
+
+
+def bench_new(rows):
+    import database
+    started = time.perf_counter()
+    for i in range(rows):
+        database.add_download_to_history(i % 50, f"title {i}", f"https://youtu.be/{i:011d}", "mp3")
+    caller = time.perf_counter() - started
+    database.flush_history()
+    total = time.perf_counter() - started
+    return caller, total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        import database
+        database.init_db()
+
+        # Старая схема: без WAL и без индексов
+        database.close_db()
+        conn = sqlite3.connect("users.db")
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+        caller, total = bench_old(args.rows)
+        print(f"old: caller {args.rows / caller:10.0f} rows/s   total {args.rows / total:10.0f} rows/s")
+
+        database.init_db()
+        caller, total = bench_new(args.rows)
+        print(f"new: caller {args.rows / caller:10.0f} rows/s   total {args.rows / total:10.0f} rows/s")
+
+        assert count_rows() == 2 * args.rows
+        database.close_db()
+        os.chdir(ROOT)
+
+
+if __name__ == "__main__":
+    main()
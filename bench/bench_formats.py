@@ -0,0 +1,94 @@
+# bench_formats.py
+# Сколько процессорного времени ffmpeg уходит на один файл при каждом пути
+# из formats.py. Время считается по getrusage(RUSAGE_CHILDREN) — это CPU
+# всех дочерних ffmpeg, а не время по часам.
+#
+#   python bench/bench_formats.py [--seconds 60] [--height 720] [--ffmpeg ffmpeg]
+#
+# Исходники синтетические (testsrc + синус), в тех же контейнерах и кодеках,
+# что отдаёт YouTube: MP4 с H.264, M4A с AAC, WebM с VP9 и Opus. Что
+# меряется (так ffmpeg вызывают yt-dlp и streaming.py):
+#   video copy       — готовый MP4 avc1+mp4a: ffmpeg не запускается;
+#   video remux      — H.264 + AAC -> MP4 с -c copy (было: VP9 + Opus, тоже copy);
+#   video transcode  — VP9 + Opus -> H.264/AAC (FFmpegVideoConvertor для не-MP4);
+#   audio mp3        — AAC -> MP3 192 кбит/с (FFmpegExtractAudio, stream_mp3);
+#   audio m4a copy   — AAC как есть (AUDIO_PASSTHROUGH): ffmpeg не запускается.
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def ffmpeg(binary, *args):
+    subprocess.run([binary, "-hide_banner", "-loglevel", "error", "-y", *args], check=True)
+
+
+def make_sources(binary, workdir, seconds, height):
+    width = height * 16 // 9
+    video = ["-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={seconds}"]
+    audio = ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}"]
+    paths = {name: os.path.join(workdir, name) for name in ("avc.mp4", "aac.m4a", "vp9.webm", "opus.webm")}
+    ffmpeg(binary, *video, "-an", "-c:v", "libx264", "-preset", "veryfast", paths["avc.mp4"])
+    ffmpeg(binary, *audio, "-c:a", "aac", "-b:a", "128k", paths["aac.m4a"])
+    ffmpeg(binary, *video, "-an", "-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8",
+           "-b:v", "1M", paths["vp9.webm"])
+    ffmpeg(binary, *audio, "-c:a", "libopus", "-b:a", "128k", paths["opus.webm"])
+    return paths
+
+
+def cases(paths, out):
+    return [
+        ("video copy", None),
+        ("video remux (vp9+opus, before)", [
+            "-i", paths["vp9.webm"], "-i", paths["opus.webm"], "-map", "0:v", "-map", "1:a",
+            "-c", "copy", "-strict", "experimental", out("merged.mp4"),
+        ]),
+        ("video remux (avc1+mp4a)", [
+            "-i", paths["avc.mp4"], "-i", paths["aac.m4a"], "-map", "0:v", "-map", "1:a",
+            "-c", "copy", "-movflags", "+faststart", out("merged.mp4"),
+        ]),
+        ("video transcode", [
+            "-i", paths["vp9.webm"], "-i", paths["opus.webm"], "-map", "0:v", "-map", "1:a",
+            "-c:v", "libx264", "-c:a", "aac", out("converted.mp4"),
+        ]),
+        ("audio mp3 (before)", ["-i", paths["aac.m4a"], "-vn", "-c:a", "libmp3lame", "-b:a", "192k", out("audio.mp3")]),
+        ("audio m4a copy", None),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"Готовлю исходники: {args.seconds} с, {args.height}p...")
+        paths = make_sources(args.ffmpeg, workdir, args.seconds, args.height)
+
+        def out(name):
+            return os.path.join(workdir, name)
+
+        print(f"{'path':<32} {'cpu':>8} {'x realtime':>11}")
+        for name, ffmpeg_args in cases(paths, out):
+            if ffmpeg_args is None:
+                print(f"{name:<32} {0.0:>7.2f}s {'-':>11}")
+                continue
+            before = children_cpu()
+            ffmpeg(args.ffmpeg, *ffmpeg_args)
+            cpu = children_cpu() - before
+            print(f"{name:<32} {cpu:>7.2f}s {cpu / args.seconds:>10.3f}x")
+
+
+if __name__ == "__main__":
+    main()
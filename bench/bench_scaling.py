@@ -0,0 +1,102 @@
+# bench_scaling.py
+# Пропускная способность очереди задач (jobqueue) при 1/2/4 процессах-
+# воркерах, как в worker.py, но без Telegram: задача — занять процессор на
+# --job-ms миллисекунд (как конвертация ffmpeg/теги) и подождать --io-ms
+# (как сеть). Печатает задач в секунду и ускорение относительно одного
+# процесса. Время — от момента, когда все процессы запущены и готовы (без
+# spawn и импортов), до последней выполненной задачи.
+#
+#   python bench/bench_scaling.py [--jobs 200] [--workers 1 2 4] [--job-ms 20] [--io-ms 0]
+#
+# Линейный рост для процессорной работы возможен, только если ядер не
+# меньше, чем процессов (os.cpu_count() печатается в начале). Задачи с
+# --io-ms масштабируются и на одном ядре — за счёт --concurrency.
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobqueue
+
+
+def busy(ms):
+    # Процессорное время самого процесса, а не время по часам: пока процесс
+    # вытеснен другим, его задача не продвигается, как и настоящий ffmpeg
+    deadline = time.process_time() + ms / 1000
+    while time.process_time() < deadline:
+        pass
+
+
+def worker_main(path, index, concurrency, ready, done):
+    broker = jobqueue.SQLiteBroker(path)
+
+    async def work(payload):
+        busy(payload["job_ms"])
+        if payload["io_ms"]:
+            await asyncio.sleep(payload["io_ms"] / 1000)
+
+    # Задачи берём, только когда готовы все процессы
+    ready.wait()
+    try:
+        asyncio.run(jobqueue.consume(broker, {"work": work}, f"w{index}", concurrency, drain=True))
+    finally:
+        done.put(index)
+
+
+def run(workdir, workers, args):
+    path = os.path.join(workdir, f"jobs-{workers}.db")
+    broker = jobqueue.SQLiteBroker(path)
+    for _ in range(args.jobs):
+        broker.put("work", {"job_ms": args.job_ms, "io_ms": args.io_ms})
+
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(workers + 1)
+    done = context.Queue()
+    processes = [
+        context.Process(target=worker_main, args=(path, index, args.concurrency, ready, done))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    ready.wait()
+    started = time.perf_counter()
+    for _ in processes:
+        done.get()
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    counts = broker.counts()
+    if counts.get("done", 0) != args.jobs:
+        print(f"  не все задачи выполнены: {counts}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--job-ms", type=float, default=20)
+    parser.add_argument("--io-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    print(f"cpu_count={os.cpu_count()} jobs={args.jobs} job_ms={args.job_ms} "
+          f"io_ms={args.io_ms} concurrency={args.concurrency}")
+    print(f"{'workers':>7} {'time':>8} {'jobs/s':>8} {'speedup':>8}")
+    base = None
+    with tempfile.TemporaryDirectory() as workdir:
+        for workers in args.workers:
+            elapsed = run(workdir, workers, args)
+            rate = args.jobs / elapsed
+            base = base or rate
+            print(f"{workers:>7} {elapsed:>7.2f}s {rate:>8.1f} {rate / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# bench_startup.py
+# Холодный старт бота: сколько занимает import main и через сколько после
+# запуска обработан первый апдейт (/start), сейчас и при прежнем порядке
+# запуска.
+#
+#   python bench/bench_startup.py [--repeat 5] [--connect-ms 300]
+#
+# Каждый замер — отдельный процесс (модули не закэшированы в sys.modules),
+# время — от первой строки процесса, без запуска самого интерпретатора.
+# Подключение к Telegram заменено задержкой --connect-ms (Client из
+# replay.py), сразу после неё приходит /start. Режимы:
+#   lazy  — как сейчас: yt_dlp грузится в фоне после подключения, только
+#           экстракторы YouTube, init_db и синхронизация кэша — во время
+#           подключения;
+#   eager — как было: import yt_dlp и YoutubeDL() со всеми экстракторами,
+#           init_db() и media_cache.sync() до подключения.
+# Настоящие pyrogram и yt_dlp используются, если установлены (без yt_dlp
+# бенчмарк не имеет смысла); без pyrogram — заглушки из replay.py.
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTED = time.perf_counter()
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+MARKER = "STARTUP "
+STAGES = ("pyrogram", "import", "first_update", "warm")
+
+
+def child(mode, connect_ms):
+    timings = {}
+
+    def mark(name):
+        timings[name] = round(time.perf_counter() - STARTED, 4)
+
+    import replay
+
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    os.chdir(workdir)
+    try:
+        import pyrogram
+    except ImportError:
+        replay.install_stubs(youtube=False)
+        import pyrogram
+    mark("pyrogram")
+
+    if mode == "eager":
+        import yt_dlp
+        yt_dlp.YoutubeDL({"quiet": True})
+
+    first_update = asyncio.Event()
+    telegram = replay.Telegram(argparse.Namespace(api_ms=0, upload_mbps=1000))
+
+    class StartupClient(replay.Client):
+        async def start(self):
+            await asyncio.sleep(connect_ms / 1000)
+            asyncio.ensure_future(self.deliver())
+
+        async def deliver(self):
+            chat = argparse.Namespace(id=1)
+            user = argparse.Namespace(id=1, username="bench", first_name="Bench")
+            await app.start_handler(self, replay.Message(telegram, chat, user, "/start"))
+            mark("first_update")
+            first_update.set()
+
+    pyrogram.Client = StartupClient
+    import main as app
+    import downloader
+    mark("import")
+
+    if mode == "eager":
+        app.init_db()
+        app.media_cache.sync()
+
+    async def idle():
+        await first_update.wait()
+        while downloader._extractors is None:
+            await asyncio.sleep(0.005)
+        mark("warm")
+
+    app.idle = idle
+    app.METRICS_PORT = None
+    asyncio.run(app.main())
+    print(MARKER + json.dumps(timings), flush=True)
+    os.chdir(BENCH_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def measure(mode, connect_ms):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, "--connect-ms", str(connect_ms)],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    for line in output.splitlines():
+        if line.startswith(MARKER):
+            return json.loads(line[len(MARKER):])
+    raise RuntimeError(f"No timings in output:\n{output}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--connect-ms", type=float, default=300)
+    parser.add_argument("--child", choices=("lazy", "eager"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.connect_ms)
+        return
+
+    try:
+        import yt_dlp  # noqa: F401
+    except ImportError:
+        sys.exit("yt_dlp не установлен")
+
+    print(f"connect={args.connect_ms:.0f}ms, медиана из {args.repeat}, секунды от старта процесса")
+    print(f"{'mode':<6} " + " ".join(f"{stage:>13}" for stage in STAGES))
+    for mode in ("eager", "lazy"):
+        runs = [measure(mode, args.connect_ms) for _ in range(args.repeat)]
+        print(f"{mode:<6} " + " ".join(
+            f"{statistics.median(run[stage] for run in runs):>12.3f}s" for stage in STAGES
+        ))
+
+
+if __name__ == "__main__":
+    main()
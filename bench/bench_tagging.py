@@ -0,0 +1,116 @@
+# bench_tagging.py
+# Запись тегов в MP3 размером 5/50/200 МБ: eyed3 (как было в set_mp3_tags)
+# против tagging.write_tags.
+#
+#   python bench/bench_tagging.py [--sizes 5 50 200] [--repeat 3]
+#
+# Файлы синтетические: тег как после ffmpeg (ID3v2.4 с TSSE, без запаса)
+# и одинаковые MPEG-кадры 128 кбит/с. Для каждого размера:
+#   first  — первая запись названия/автора в свежий файл;
+#   second — повторная правка того же файла (у tagging — на месте);
+#   cover  — то же с обложкой 30 КБ;
+#   clone  — копия файла из кэша, которому заранее сделан reserve()
+#            (так готовит файлы mediacache), затем правка копии.
+# eyed3 необязателен: без него печатается только tagging.
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tagging
+
+try:
+    import eyed3
+    eyed3.log.setLevel("ERROR")
+except ImportError:
+    eyed3 = None
+
+# MPEG-1 Layer III, 128 кбит/с, 44.1 кГц: 417 байт на кадр
+FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+COVER = b"\xff\xd8\xff\xe0" + b"\x55" * 30000
+
+
+def make_mp3(path, megabytes):
+    body = b"TSSE" + tagging._to_synchsafe(14) + b"\x00\x00" + b"\x03Lavf60.16.100"
+    chunk = FRAME * 2500
+    with open(path, "wb") as f:
+        f.write(b"ID3\x04\x00\x00" + tagging._to_synchsafe(len(body)) + body)
+        left = megabytes * 1024 * 1024
+        while left > 0:
+            f.write(chunk[:left])
+            left -= len(chunk)
+
+
+def eyed3_tags(path, title, artist, cover=None):
+    # Старый set_mp3_tags (плюс обложка для сравнения)
+    audiofile = eyed3.load(path)
+    if audiofile.tag is None:
+        audiofile.initTag()
+    audiofile.tag.title = title
+    audiofile.tag.artist = artist
+    if cover:
+        audiofile.tag.images.set(3, cover, "image/jpeg")
+    audiofile.tag.save()
+
+
+def fast_tags(path, title, artist, cover=None):
+    tagging.write_tags(path, title, artist, cover)
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def run(engine, source, workdir, repeat):
+    results = {"first": [], "second": [], "cover": [], "clone": []}
+    for i in range(repeat):
+        path = os.path.join(workdir, f"{engine.__name__}-{i}.mp3")
+        shutil.copyfile(source, path)
+        results["first"].append(timed(engine, path, "Первое название", "Автор"))
+        results["second"].append(timed(engine, path, "Второе название", "Другой автор"))
+        results["cover"].append(timed(engine, path, "Третье название", "Автор", COVER))
+        os.remove(path)
+
+        cached = os.path.join(workdir, f"cached-{i}.mp3")
+        shutil.copyfile(source, cached)
+        tagging.reserve(cached, 64 * 1024)
+        copy = os.path.join(workdir, f"copy-{i}.mp3")
+        shutil.copyfile(cached, copy)
+        results["clone"].append(timed(engine, copy, "Название", "Автор", COVER))
+        os.remove(cached)
+        os.remove(copy)
+    return {name: min(values) for name, values in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 50, 200])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    engines = [fast_tags] + ([eyed3_tags] if eyed3 else [])
+    if eyed3 is None:
+        print("eyed3 не установлен, сравнения не будет")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"{'size':>6} {'engine':>10} {'first':>9} {'second':>9} {'cover':>9} {'clone':>9}")
+        for megabytes in args.sizes:
+            source = os.path.join(workdir, f"source-{megabytes}.mp3")
+            make_mp3(source, megabytes)
+            for engine in engines:
+                times = run(engine, source, workdir, args.repeat)
+                name = engine.__name__.replace("_tags", "")
+                print(f"{megabytes:>4}MB {name:>10} " + " ".join(
+                    f"{times[key] * 1000:>7.1f}ms" for key in ("first", "second", "cover", "clone")
+                ))
+            os.remove(source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# bench_workers.py
+# Задержка хендлеров, пока идут тяжёлые загрузки.
+#
+#   python bench/bench_workers.py [--jobs 40] [--job-seconds 0.25] [--workers N]
+#
+# Режимы:
+#   inline  — загрузка вызывается прямо в корутине (как было раньше);
+#   thread  — через DownloadQueue(mode="thread") (DOWNLOAD_POOL = "thread");
+#   process — через DownloadQueue(mode="process").
+# Задачи двух видов:
+#   io  — time.sleep(): отпускает GIL, как ожидание сети;
+#   cpu — цикл на чистом Python, держит GIL, как extract_info и разбор
+#         ответов YouTube в yt-dlp.
+# Задачи приходят по одной каждые --arrival-ms, как апдейты. Фоновый
+# "хендлер" каждые 10 мс замеряет, насколько позже запланированного он
+# получил управление; inline даёт лишь несколько замеров, поэтому при малом
+# их числе перцентили не печатаются. --workers по умолчанию —
+# DOWNLOAD_WORKERS из config.py, поэтому при --jobs больше него задачи ждут в
+# очереди, и позиции в ней сообщаются так же, как в боте.
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DOWNLOAD_WORKERS
+from workers import DownloadQueue
+
+# Меньше замеров — перцентили не печатаются
+MIN_SAMPLES = 100
+
+
+def sleep_job(seconds):
+    # Имитация ожидания сети: блокирующий вызов без GIL
+    time.sleep(seconds)
+    return seconds
+
+
+def cpu_job(iterations):
+    # Имитация работы yt-dlp на Python: всё время держит GIL
+    total = 0
+    for i in range(iterations):
+        total += i * i
+    return total
+
+
+def calibrate(seconds):
+    # Сколько итераций cpu_job занимают seconds на одном ядре
+    iterations = 100_000
+    while True:
+        started = time.process_time()
+        cpu_job(iterations)
+        elapsed = time.process_time() - started
+        if elapsed > 0.2:
+            return int(iterations * seconds / elapsed)
+        iterations *= 2
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def measure_latency(stop, samples, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append((loop.time() - expected) * 1000)
+
+
+async def run(mode, job, arg, jobs, workers, arrival):
+    queue = DownloadQueue(max_workers=workers, per_user=1, mode="thread" if mode == "inline" else mode,
+                          notify_interval=0.1)
+    stop = asyncio.Event()
+    samples = []
+    notified = []
+
+    async def on_queued(position):
+        notified.append(position)
+
+    async def inline_handler(user_id):
+        await asyncio.sleep(user_id * arrival)
+        return job(arg)
+
+    async def queued_handler(user_id):
+        await asyncio.sleep(user_id * arrival)
+        return await queue.run(user_id, job, arg, on_queued=on_queued)
+
+    if mode == "process":
+        # Пул процессов запускается заранее, как после первой загрузки в боте
+        await queue.run(-1, job, 0)
+
+    probe = asyncio.create_task(measure_latency(stop, samples))
+    handler = inline_handler if mode == "inline" else queued_handler
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(user_id) for user_id in range(jobs)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await probe
+    queue.shutdown()
+    return elapsed, samples, notified
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--job-seconds", type=float, default=0.25)
+    parser.add_argument("--arrival-ms", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS)
+    parser.add_argument("--kinds", nargs="+", choices=("io", "cpu"), default=["io", "cpu"])
+    parser.add_argument("--modes", nargs="+", choices=("inline", "thread", "process"),
+                        default=["inline", "thread", "process"])
+    args = parser.parse_args()
+
+    print(f"{args.jobs} jobs x {args.job_seconds}s, {args.workers} workers, cpu_count={os.cpu_count()}")
+    jobs = {"io": (sleep_job, args.job_seconds), "cpu": (cpu_job, calibrate(args.job_seconds))}
+    for kind in args.kinds:
+        job, arg = jobs[kind]
+        for mode in args.modes:
+            elapsed, samples, notified = asyncio.run(
+                run(mode, job, arg, args.jobs, args.workers, args.arrival_ms / 1000)
+            )
+            if len(samples) >= MIN_SAMPLES:
+                latency = f"p50 {percentile(samples, 50):8.1f} ms  p99 {percentile(samples, 99):8.1f} ms"
+            else:
+                latency = f"p50 {'-':>8}     p99 {'-':>8}   "
+            print(
+                f"{kind:>3} {mode:>7}: total {elapsed:6.2f}s  handler latency {latency}  "
+                f"max {max(samples, default=0):8.1f} ms  ({len(samples)} samples, "
+                f"{len(notified)} queue updates)"
+            )
+
+
+if __name__ == "__main__":
+    main()
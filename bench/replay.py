@@ -0,0 +1,668 @@
+# replay.py
+# Нагрузочный прогон настоящих хендлеров main.py без сети. Telegram и
+# YouTube заменены заглушками: вместо pyrogram — модули с Client, Message,
+# CallbackQuery и filters, вместо yt_dlp — YoutubeDL, который «скачивает»
+# файлы нужного размера с заданной задержкой и скоростью. Поток апдейтов
+# генерируется или читается из JSONL.
+#
+#   python bench/replay.py [--users 50] [--videos 20] [--ramp 10] [--think 0.5]
+#   python bench/replay.py --users 20 --save updates.jsonl    # сохранить поток
+#   python bench/replay.py --replay updates.jsonl
+#
+# Строка JSONL — один апдейт от пользователя user через t секунд от начала:
+#   {"t": 0.0, "user": 1, "text": "https://youtu.be/dQw4w9WgXcQ"}
+#   {"t": 2.5, "user": 1, "data": "choose_mp3"}       (нажатие кнопки)
+# Кнопка нажимается под последним сообщением бота с клавиатурой в этом
+# чате. Апдейты одного пользователя идут по очереди (следующий — не раньше,
+# чем закончился хендлер предыдущего), разных — параллельно, не больше
+# --handler-workers одновременно, как в pyrogram.
+#
+# Бот работает во временном каталоге (свои users.db и downloads/), его
+# вывод (в том числе JSON-строки задач) — в bot.log там же, --keep оставляет
+# каталог. В конце: апдейтов в секунду, задержка хендлеров p50/p95/p99/max,
+# задачи по видам и путям из лога, пиковый RSS и пиковый объём файлов.
+# Код выхода 1, если хендлер упал с исключением.
+import argparse
+import asyncio
+import contextlib
+import inspect
+import itertools
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+VIDEO_ID_RE = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([\w-]{11})")
+PLAYLIST_ID_RE = re.compile(r"[?&]list=([\w-]+)")
+
+# Битрейт по высоте (кбит/с) для размера «скачанных» файлов
+VIDEO_KBPS = {360: 700, 480: 1200, 720: 2500, 1080: 4500}
+
+# Сценарии пользователей для сгенерированного потока: апдейты по порядку
+FLOWS = {
+    "mp3": lambda link, rng: [{"text": link}, {"data": "choose_mp3"}, {"data": "no_metadata"}],
+    "mp3_tags": lambda link, rng: [
+        {"text": link}, {"data": "choose_mp3"}, {"data": "yes_metadata"},
+        {"text": "Новое название"}, {"text": "Новый исполнитель"},
+    ],
+    "video": lambda link, rng: [
+        {"text": link}, {"data": "choose_video"}, {"data": f"quality_{rng.choice(list(VIDEO_KBPS))}p"},
+    ],
+    "batch": lambda link, rng: [{"text": "https://www.youtube.com/playlist?list=PLbench" + link[-11:]}, {"data": "batch_mp3"}],
+}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+# --- YouTube ---
+
+class Backend:
+    # Каталог видео и счётчики; параметры — из аргументов командной строки
+    def __init__(self, args):
+        self.probe_delay = args.probe_ms / 1000
+        self.bandwidth = args.download_mbps * 1024 * 1024 / 8
+        self.convert_delay = args.convert_ms / 1000
+        self.playlist_size = args.playlist_size
+        self.size_scale = args.size_scale
+        self.probes = 0
+        self.downloads = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def info(self, video_id):
+        # Одни и те же данные для одного id: длительность 2–10 минут
+        duration = 120 + sum(map(ord, video_id)) % 480
+        audio = int(duration * 128 * 1024 / 8 * self.size_scale)
+        formats = [
+            {"format_id": "140", "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.2", "abr": 129},
+            {"format_id": "251", "ext": "webm", "vcodec": "none", "acodec": "opus", "abr": 140},
+            {"format_id": "18", "ext": "mp4", "vcodec": "avc1.42001E", "acodec": "mp4a.40.2", "height": 360,
+             "tbr": VIDEO_KBPS[360]},
+        ]
+        for format_id, height in (("135", 480), ("136", 720), ("137", 1080)):
+            formats.append({"format_id": format_id, "ext": "mp4", "vcodec": "avc1.4d401f", "acodec": "none",
+                            "height": height, "tbr": VIDEO_KBPS[height]})
+        for fmt in formats:
+            fmt["protocol"] = "https"
+        # HLS со звуком, как itag 95 у YouTube: avc1+mp4a в mp4 с наибольшим
+        # битрейтом на 720p, но не готовый файл — formats.py его не выбирает
+        formats.append({"format_id": "95", "ext": "mp4", "vcodec": "avc1.4d401f", "acodec": "mp4a.40.2",
+                        "height": 720, "tbr": VIDEO_KBPS[720] + 300, "protocol": "m3u8_native"})
+        for fmt in formats:
+            rate = fmt.get("tbr") or fmt.get("abr")
+            fmt["filesize"] = int(duration * rate * 1024 / 8 * self.size_scale)
+        # Без "url": потоковый режим не выбирается, всё идёт через YoutubeDL
+        return {
+            "id": video_id, "title": f"Video {video_id}", "uploader": "Bench channel", "duration": duration,
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}", "ext": "mp4", "formats": formats,
+            "_audio_size": audio,
+        }
+
+    def playlist(self, playlist_id):
+        entries = []
+        for index in range(self.playlist_size):
+            video_id = (playlist_id + f"{index:03d}")[-11:].rjust(11, "x")
+            info = self.info(video_id)
+            entries.append({"id": video_id, "url": info["webpage_url"], "title": info["title"],
+                            "duration": info["duration"]})
+        return {"_type": "playlist", "id": playlist_id, "entries": entries}
+
+    def selected_size(self, info, spec):
+        # Размер файла для строки формата из formats.py/downloader.py
+        by_id = {fmt["format_id"]: fmt for fmt in info["formats"]}
+        ids = spec.split("+")
+        if all(format_id in by_id for format_id in ids):
+            return sum(by_id[format_id]["filesize"] for format_id in ids), by_id[ids[0]]["ext"]
+        if spec.startswith("bestaudio"):
+            return info["_audio_size"], "m4a"
+        match = re.search(r"height<=(\d+)", spec)
+        height = min((h for h in VIDEO_KBPS if h <= int(match.group(1))), default=360) if match else 720
+        return int(info["duration"] * (VIDEO_KBPS[height] + 128) * 1024 / 8 * self.size_scale), "webm"
+
+
+class DownloadError(Exception):
+    pass
+
+
+class YoutubeDL:
+    backend = None
+
+    def __init__(self, params=None, auto_init=True):
+        self.params = params or {}
+
+    def add_info_extractor(self, extractor):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def sanitize_info(self, info, remove_private_keys=False):
+        return dict(info)
+
+    def extract_info(self, url, download=True):
+        backend = self.backend
+        time.sleep(backend.probe_delay)
+        with backend._lock:
+            backend.probes += 1
+        playlist = PLAYLIST_ID_RE.search(url)
+        if playlist and "watch?" not in url:
+            return backend.playlist(playlist.group(1))
+        match = VIDEO_ID_RE.search(url)
+        if not match:
+            raise DownloadError(f"Unsupported URL: {url}")
+        return self.process_ie_result(backend.info(match.group(1)), download)
+
+    def process_ie_result(self, info, download=True):
+        info = dict(info)
+        if download:
+            self._download(info)
+        return info
+
+    def prepare_filename(self, info):
+        template = self.params.get("outtmpl", "%(title)s.%(ext)s")
+        return template.replace("%(title)s", info["title"]).replace("%(ext)s", info["ext"])
+
+    def _hooks(self, name, **event):
+        for hook in self.params.get(name) or []:
+            hook(event)
+
+    def _download(self, info):
+        backend = self.backend
+        size, ext = backend.selected_size(info, self.params.get("format", "best"))
+        info["format_id"] = self.params.get("format")
+        info["ext"] = self.params.get("merge_output_format") or ext
+        path = self.prepare_filename(info)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        chunk = b"\x00" * (256 * 1024)
+        written = 0
+        started = time.monotonic()
+        with open(path, "wb") as f:
+            while written < size:
+                block = chunk[:size - written]
+                f.write(block)
+                written += len(block)
+                # Скорость ограничиваем сном: сколько должно было пройти к этому байту
+                delay = started + written / backend.bandwidth - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self._hooks("progress_hooks", status="downloading", downloaded_bytes=written, total_bytes=size)
+        self._hooks("progress_hooks", status="finished", downloaded_bytes=size, total_bytes=size)
+
+        for postprocessor in self.params.get("postprocessors") or []:
+            self._hooks("postprocessor_hooks", status="started", postprocessor=postprocessor["key"])
+            time.sleep(backend.convert_delay)
+            target = postprocessor.get("preferredcodec") or postprocessor.get("preferedformat")
+            if target:
+                new_path = os.path.splitext(path)[0] + "." + target
+                os.replace(path, new_path)
+                path = new_path
+            self._hooks("postprocessor_hooks", status="finished", postprocessor=postprocessor["key"])
+
+        with backend._lock:
+            backend.downloads += 1
+            backend.bytes += size
+
+
+# --- Telegram ---
+
+class Filter:
+    def __init__(self, check):
+        self.check = check
+
+    def __call__(self, update):
+        return self.check(update)
+
+    def __and__(self, other):
+        return Filter(lambda update: self(update) and other(update))
+
+    def __or__(self, other):
+        return Filter(lambda update: self(update) or other(update))
+
+    def __invert__(self):
+        return Filter(lambda update: not self(update))
+
+
+def _update_text(update):
+    # regex проверяет текст сообщения или data кнопки
+    return getattr(update, "data", None) or getattr(update, "text", None) or ""
+
+
+def _is_command(name):
+    def check(update):
+        text = getattr(update, "text", None) or ""
+        return text.split()[:1] == ["/" + name]
+    return Filter(check)
+
+
+filters = types.SimpleNamespace(
+    command=_is_command,
+    user=lambda ids: Filter(lambda update: update.from_user.id in ids),
+    regex=lambda pattern: Filter(lambda update: re.search(pattern, _update_text(update)) is not None),
+    audio=Filter(lambda update: getattr(update, "audio", None) is not None),
+    document=Filter(lambda update: getattr(update, "document", None) is not None),
+    text=Filter(lambda update: getattr(update, "text", None) is not None),
+)
+
+
+class Client:
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+        self.handlers = {"message": [], "callback": []}
+
+    def _register(self, kind, flt):
+        def decorator(fn):
+            self.handlers[kind].append((flt, fn))
+            return fn
+        return decorator
+
+    def on_message(self, flt=None):
+        return self._register("message", flt)
+
+    def on_callback_query(self, flt=None):
+        return self._register("callback", flt)
+
+    def find_handler(self, kind, update):
+        # Как pyrogram: первый подходящий хендлер группы
+        for flt, fn in self.handlers[kind]:
+            if flt is None or flt(update):
+                return fn
+        return None
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+async def idle():
+    pass
+
+
+class FloodWait(Exception):
+    value = 0
+
+
+class MessageNotModified(Exception):
+    pass
+
+
+class _Markup:
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+class InputMediaAudio(_Markup):
+    def __init__(self, media, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.media = media
+
+
+class InputMediaVideo(InputMediaAudio):
+    pass
+
+
+class Telegram:
+    # Задержка API и скорость отправки файлов; счётчики вызовов и ответов бота
+    def __init__(self, args):
+        self.latency = args.api_ms / 1000
+        self.bandwidth = args.upload_mbps * 1024 * 1024 / 8
+        self.ids = itertools.count(1)
+        self.file_ids = {}
+        self.keyboards = {}
+        self.calls = 0
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.answers = defaultdict(int)
+
+    async def call(self):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+    def note(self, chat_id, message, text, reply_markup):
+        # Ответы бота по первой строке: ошибки, отказы лимитов и т. п.
+        if text and text[:1] in ("❌", "⏳"):
+            self.answers[text.splitlines()[0][:60]] += 1
+        if reply_markup is not None:
+            self.keyboards[chat_id] = message
+
+    async def upload(self, chat, kind, media, progress=None):
+        await self.call()
+        if isinstance(media, str) and media in self.file_ids:
+            size = 0  # повторная отправка по file_id
+        elif isinstance(media, str):
+            size = os.path.getsize(media)
+        else:
+            size = len(media.getbuffer())
+        if size:
+            await asyncio.sleep(size / self.bandwidth)
+            self.uploads += 1
+            self.upload_bytes += size
+            if progress is not None:
+                result = progress(size, size)
+                if inspect.isawaitable(result):
+                    await result
+        file_id = f"{kind}-{next(self.ids)}"
+        self.file_ids[file_id] = size or self.file_ids.get(media, 0)
+        message = Message(self, chat, None)
+        setattr(message, kind, types.SimpleNamespace(file_id=file_id, file_size=self.file_ids[file_id]))
+        return message
+
+
+class Message:
+    def __init__(self, telegram, chat, from_user, text=None):
+        self._telegram = telegram
+        self.id = next(telegram.ids)
+        self.chat = chat
+        self.from_user = from_user
+        self.text = text
+        self.command = text[1:].split() if text and text.startswith("/") else None
+        self.audio = None
+        self.video = None
+        self.document = None
+        self.reply_markup = None
+
+    async def reply(self, text, reply_markup=None, **kwargs):
+        await self._telegram.call()
+        message = Message(self._telegram, self.chat, None, text)
+        message.reply_markup = reply_markup
+        self._telegram.note(self.chat.id, message, text, reply_markup)
+        return message
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        await self._telegram.call()
+        self.text = text
+        self.reply_markup = reply_markup
+        self._telegram.note(self.chat.id, self, text, reply_markup)
+        return self
+
+    async def reply_video(self, video, progress=None, **kwargs):
+        return await self._telegram.upload(self.chat, "video", video, progress)
+
+    async def reply_audio(self, audio, progress=None, **kwargs):
+        return await self._telegram.upload(self.chat, "audio", audio, progress)
+
+    async def reply_media_group(self, media, **kwargs):
+        kind = "audio" if isinstance(media[0], InputMediaAudio) and not isinstance(media[0], InputMediaVideo) else "video"
+        return [await self._telegram.upload(self.chat, kind, item.media) for item in media]
+
+
+class CallbackQuery:
+    def __init__(self, telegram, from_user, message, data):
+        self._telegram = telegram
+        self.id = str(next(telegram.ids))
+        self.from_user = from_user
+        self.message = message
+        self.data = data
+
+    async def answer(self, text=None, show_alert=False, **kwargs):
+        await self._telegram.call()
+        if text:
+            self._telegram.note(self.message.chat.id, self.message, text, None)
+
+
+def install_stubs(telegram=True, youtube=True):
+    # До импорта main.py: он и его модули импортируют pyrogram и yt_dlp
+    if telegram:
+        pyrogram = types.ModuleType("pyrogram")
+        pyrogram.Client = Client
+        pyrogram.filters = filters
+        pyrogram.idle = idle
+        pyrogram.types = types.ModuleType("pyrogram.types")
+        for cls in (Message, CallbackQuery, InputMediaAudio, InputMediaVideo):
+            setattr(pyrogram.types, cls.__name__, cls)
+        pyrogram.types.InlineKeyboardMarkup = _Markup
+        pyrogram.types.InlineKeyboardButton = _Markup
+        pyrogram.errors = types.ModuleType("pyrogram.errors")
+        pyrogram.errors.FloodWait = FloodWait
+        pyrogram.errors.MessageNotModified = MessageNotModified
+        sys.modules.update({"pyrogram": pyrogram, "pyrogram.types": pyrogram.types, "pyrogram.errors": pyrogram.errors})
+
+    if youtube:
+        yt_dlp = types.ModuleType("yt_dlp")
+        yt_dlp.YoutubeDL = YoutubeDL
+        yt_dlp.utils = types.ModuleType("yt_dlp.utils")
+        yt_dlp.utils.DownloadError = DownloadError
+        yt_dlp.extractor = types.ModuleType("yt_dlp.extractor")
+        yt_dlp.extractor.youtube = types.ModuleType("yt_dlp.extractor.youtube")
+        yt_dlp.extractor.youtube.YoutubeIE = object
+        sys.modules.update({
+            "yt_dlp": yt_dlp, "yt_dlp.utils": yt_dlp.utils,
+            "yt_dlp.extractor": yt_dlp.extractor, "yt_dlp.extractor.youtube": yt_dlp.extractor.youtube,
+        })
+
+
+# --- поток апдейтов ---
+
+def generate(args):
+    rng = random.Random(args.seed)
+    video_ids = [f"bench{index:06d}" for index in range(args.videos)]
+    # Популярность по Ципфу: первые видео просят чаще — кэши работают как в жизни
+    weights = [1 / (rank + 1) for rank in range(len(video_ids))]
+    mix = {}
+    for part in args.mix.split(","):
+        name, _, weight = part.partition("=")
+        mix[name] = float(weight or 1)
+
+    events = []
+    for user in range(1, args.users + 1):
+        t = rng.uniform(0, args.ramp)
+        for _ in range(args.requests):
+            video_id = rng.choices(video_ids, weights)[0]
+            flow = rng.choices(list(mix), list(mix.values()))[0]
+            for step in FLOWS[flow](f"https://www.youtube.com/watch?v={video_id}", rng):
+                events.append({"t": round(t, 3), "user": 1000 + user, **step})
+                t += rng.expovariate(1 / args.think) if args.think else 0
+    events.sort(key=lambda event: event["t"])
+    return events
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class DiskSampler:
+    # Пиковый объём файлов в каталоге (downloads/, кэш, базы)
+    def __init__(self, root, interval=0.1):
+        self.root = root
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="disk-sampler", daemon=True)
+
+    def sample(self):
+        total = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(directory, name))
+                except OSError:
+                    pass
+        self.peak = max(self.peak, total)
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+async def replay(app, telegram, events, workers):
+    slots = asyncio.Semaphore(workers)
+    latencies = defaultdict(list)
+    failures = []
+    by_user = defaultdict(list)
+    for event in events:
+        by_user[event["user"]].append(event)
+    started = time.monotonic()
+
+    async def handle(event):
+        user = types.SimpleNamespace(id=event["user"], username=f"user{event['user']}", first_name="Bench")
+        chat = types.SimpleNamespace(id=event["user"])
+        if "data" in event:
+            message = telegram.keyboards.get(chat.id) or Message(telegram, chat, None, "")
+            update = CallbackQuery(telegram, user, message, event["data"])
+            handler = app.bot.find_handler("callback", update)
+        else:
+            update = Message(telegram, chat, user, event["text"])
+            handler = app.bot.find_handler("message", update)
+        if handler is None:
+            return
+
+        arrived = time.monotonic()
+        async with slots:
+            try:
+                await handler(app.bot, update)
+            except Exception as e:
+                failures.append(f"{handler.__name__}: {type(e).__name__}: {e}")
+        latencies[handler.__name__].append(time.monotonic() - arrived)
+
+    async def run_user(user_events):
+        for event in user_events:
+            delay = started + event["t"] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await handle(event)
+
+    await asyncio.gather(*(run_user(user_events) for user_events in by_user.values()))
+    return time.monotonic() - started, latencies, failures
+
+
+def job_summary(log_path):
+    # JSON-строки задач из metrics.Job: число по виду, статусу и пути
+    jobs = defaultdict(int)
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.startswith('{"event": "job"'):
+                continue
+            job = json.loads(line)
+            key = f"{job['kind']} {job['status']}"
+            if job.get("source"):
+                key += f" source={job['source']}"
+            if job.get("path"):
+                key += f" path={job['path']}"
+            jobs[key] += 1
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replay", help="JSONL с апдейтами вместо сгенерированного потока")
+    parser.add_argument("--save", help="записать сгенерированный поток в JSONL")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1, help="ссылок на пользователя")
+    parser.add_argument("--videos", type=int, default=20, help="разных видео")
+    parser.add_argument("--mix", default="mp3=4,mp3_tags=1,video=4,batch=1")
+    parser.add_argument("--ramp", type=float, default=10.0, help="пользователи приходят за столько секунд")
+    parser.add_argument("--think", type=float, default=0.5, help="среднее время между действиями, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--handler-workers", type=int, default=8)
+    parser.add_argument("--api-ms", type=float, default=30.0, help="задержка вызова Telegram API")
+    parser.add_argument("--upload-mbps", type=float, default=200.0)
+    parser.add_argument("--probe-ms", type=float, default=300.0, help="extract_info")
+    parser.add_argument("--download-mbps", type=float, default=400.0)
+    parser.add_argument("--convert-ms", type=float, default=200.0, help="одна постобработка ffmpeg")
+    parser.add_argument("--playlist-size", type=int, default=5)
+    parser.add_argument("--size-scale", type=float, default=0.1,
+                        help="доля от настоящего размера файлов (1 — как у YouTube)")
+    parser.add_argument("--keep", action="store_true", help="не удалять рабочий каталог")
+    args = parser.parse_args()
+
+    events = load(args.replay) if args.replay else generate(args)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    log_path = os.path.join(workdir, "bot.log")
+    os.chdir(workdir)
+    install_stubs()
+    YoutubeDL.backend = backend = Backend(args)
+    telegram = Telegram(args)
+
+    log = open(log_path, "w", encoding="utf-8")
+    with contextlib.redirect_stdout(log), DiskSampler(workdir) as disk:
+        import main as app
+        import database
+        import tagging
+        # В main.py это делает main() при запуске бота
+        database.init_db()
+        # Обложки — тоже YouTube
+        tagging.fetch_cover = lambda video_id, timeout=10: None
+        elapsed, latencies, failures = asyncio.run(replay(app, telegram, events, args.handler_workers))
+        app.download_queue.shutdown()
+        app.probe_queue.shutdown()
+        database.close_db()
+    log.close()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    users = len({event["user"] for event in events})
+    print(f"{len(events)} апдейтов от {users} пользователей за {elapsed:.2f} с: {len(events) / elapsed:.1f} апдейтов/с")
+    print(f"{'handler':<28} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for name, values in sorted(latencies.items()):
+        print(f"{name:<28} {len(values):>6} " + " ".join(
+            f"{percentile(values, pct) * 1000:>6.0f}ms" for pct in (50, 95, 99, 100)
+        ))
+    print(f"YouTube: {backend.probes} probe, {backend.downloads} загрузок, {backend.bytes / 2**20:.0f} МБ")
+    print(f"Telegram: {telegram.calls} вызовов API, {telegram.uploads} файлов, "
+          f"{telegram.upload_bytes / 2**20:.0f} МБ")
+    print(f"Пиковый RSS: {rss / 1024:.0f} МБ (дочерние процессы: {children_rss / 1024:.0f} МБ)")
+    print(f"Пиковый объём на диске: {disk.peak / 2**20:.0f} МБ")
+
+    jobs = job_summary(log_path)
+    if jobs:
+        print("Задачи:")
+        for key, count in sorted(jobs.items()):
+            print(f"  {key}: {count}")
+    if telegram.answers:
+        print("Ответы с ошибками и отказами:")
+        for text, count in sorted(telegram.answers.items(), key=lambda item: -item[1]):
+            print(f"  {count} × {text}")
+    if failures:
+        print("Исключения в хендлерах:")
+        for failure in failures[:20]:
+            print(f"  {failure}")
+
+    if args.keep:
+        print(f"Рабочий каталог: {workdir}")
+    else:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
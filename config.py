@@ -1,3 +1,77 @@
 API_ID = 20170805
 API_HASH = "8b332bcb30dfeb62468e6945b7f5aba2"
 BOT_TOKEN = "7014334157:AAFKrxy9QE97tYXKhV9mY4oZ993g38gAYXA" 
+
+# Пул для yt-dlp/ffmpeg: "thread" или "process"
+DOWNLOAD_POOL = "thread"
+DOWNLOAD_WORKERS = 4        # одновременных загрузок на весь бот
+DOWNLOADS_PER_USER = 1      # одновременных загрузок на одного пользователя
+PROBE_WORKERS = 8           # одновременных запросов информации о видео
+
+# Telegram ID администраторов (команды /cache_stats и /cache_invalidate)
+ADMIN_IDS = []
+
+# Кэш результатов extract_info (ссылки на форматы YouTube живут ~6 часов)
+PROBE_CACHE_SIZE = 512
+PROBE_CACHE_TTL = 15 * 60   # секунд
+
+# База данных
+DB_PATH = "users.db"
+HISTORY_FLUSH_MS = 500      # как часто сбрасывать буфер истории на диск
+HISTORY_BATCH_ROWS = 100    # или сразу, когда накопилось столько строк
+
+# Потоковый режим: MP3 и готовые MP4 собираются в памяти и сразу отправляются,
+# без промежуточных файлов в downloads/ (MP3 после отправки ещё и сохраняется
+# в кэш медиа). Остальные форматы — через диск.
+STREAM_UPLOADS = True
+STREAM_MAX_BYTES = 50 * 1024 * 1024
+
+# Аудио без перекодирования: вместо MP3 отправлять исходную AAC-дорожку
+# YouTube в .m4a (ffmpeg не нужен). Telegram играет её так же, но это уже не MP3.
+AUDIO_PASSTHROUGH = False
+
+# Кэш готовых MP3/MP4 на диске: повторный запрос того же видео в том же
+# формате не скачивается и не конвертируется заново
+MEDIA_CACHE_DIR = "downloads/cache"
+MEDIA_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Место под ID3-тег с обложкой в MP3 из кэша: теги копии пишутся на месте
+MP3_TAG_RESERVE = 64 * 1024
+
+# Сессии пользователей (выбор формата, ввод метаданных)
+SESSION_MAX = 10000         # больше — вытесняются самые давние
+SESSION_TTL = 30 * 60       # секунд без действий до удаления сессии
+SESSION_PERSIST = False     # сохранять сессии в users.db между перезапусками
+
+# Прогресс загрузки: не чаще одного редактирования сообщения за столько
+# секунд в одном чате (лимиты Telegram на edit_text)
+PROGRESS_EDIT_INTERVAL = 3.0
+
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (None — выключить)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# Где выполняются загрузки: "local" — в этом же процессе; "sqlite" — бот
+# только принимает сообщения и кладёт задачи в очередь JOB_DB_PATH, а
+# выполняют их процессы worker.py (python worker.py); "memory" — та же очередь
+# задач, но в памяти бота, и выполняет её он сам (для отладки очереди)
+JOB_BROKER = "local"
+JOB_DB_PATH = "jobs.db"
+WORKER_PROCESSES = 2        # сколько процессов запускает worker.py
+WORKER_JOBS = 2             # задач одновременно в одном процессе
+JOB_LEASE = 10 * 60         # секунд; задачу упавшего воркера потом заберёт другой
+
+# Ограничение частоты запросов (token bucket): в минуту и сколько можно
+# подряд. None — без ограничения. Администраторов не касается.
+RATE_LIMIT_PER_MINUTE = 6           # ссылок/файлов от одного пользователя
+RATE_LIMIT_BURST = 3
+CHAT_RATE_LIMIT_PER_MINUTE = 20     # от всех пользователей одного чата
+CHAT_RATE_LIMIT_BURST = 10
+
+# Пакетная загрузка (плейлист или несколько ссылок в одном сообщении)
+BATCH_MAX_ITEMS = 25                # больше видео из плейлиста не берём
+BATCH_CONCURRENCY = 3               # одновременных загрузок одного пакета
+BATCH_MAX_BYTES = 1024 * 1024 * 1024  # общий объём файлов пакета
+
+# Суточная квота на пользователя (считается по истории скачиваний). None — без квоты.
+DAILY_QUOTA_BYTES = 2 * 1024 * 1024 * 1024
+DAILY_QUOTA_MINUTES = 300           # минут видео/аудио в сутки
@@ -1,12 +1,65 @@
 # database.py
+# Одно долгоживущее соединение с SQLite (WAL) на весь процесс. Запросы из
+# асинхронного кода выполняются в отдельном потоке через run_db(), а история
+# скачиваний копится в буфере и пишется пачками одной транзакцией.
 import sqlite3
 import os
+import asyncio
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import DB_PATH, HISTORY_FLUSH_MS, HISTORY_BATCH_ROWS
+
+# Счётчики попаданий в кэш file_id (с момента запуска)
+cache_stats = {"hits": 0, "misses": 0}
+
+_conn = None
+_lock = threading.RLock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+_history_buffer = []
+_history_lock = threading.Lock()
+_flush_event = threading.Event()
+_flusher = None
+
+# SQL держим в константах: sqlite3 кэширует подготовленные выражения по тексту
+INSERT_USER = "INSERT OR IGNORE INTO users (id, username, first_name) VALUES (?, ?, ?)"
+INSERT_HISTORY = """
+    INSERT INTO download_history (user_id, video_title, video_url, file_path, download_date, file_size, duration)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+SELECT_CACHED_FILE = "SELECT file_id FROM file_cache WHERE video_id = ? AND format = ?"
+INSERT_CACHED_FILE = """
+    INSERT OR REPLACE INTO file_cache (video_id, format, file_id, media_type, created)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# Общее соединение (создаётся при первом обращении)
+def get_connection():
+    global _conn
+    with _lock:
+        if _conn is None:
+            _conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=128)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+            _conn.execute("PRAGMA busy_timeout=5000")
+        return _conn
+
+# Выполнение функции этого модуля вне event loop
+async def run_db(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, fn, *args)
 
 # Инициализация базы данных
 def init_db():
-    db_file = "users.db"
-    if not os.path.exists(db_file):  # Если файла базы данных нет, создаем её
-        conn = sqlite3.connect(db_file)
+    db_exists = os.path.exists(DB_PATH)
+    with _lock:
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS users (
@@ -15,7 +68,7 @@ def init_db():
                 first_name TEXT                 -- Имя пользователя (first_name)
             )
         """)
-        
+
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS download_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -24,35 +77,239 @@ def init_db():
                 video_url TEXT,
                 file_path TEXT,
                 download_date TEXT,
+                file_size INTEGER,              -- байт отправлено пользователю
+                duration INTEGER,               -- длительность в секундах
                 FOREIGN KEY(user_id) REFERENCES users(id)
             )
         """)
+        # Базы, созданные до появления квот
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(download_history)")}
+        for column in ("file_size", "duration"):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE download_history ADD COLUMN {column} INTEGER")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_history_user_date
+            ON download_history (user_id, download_date)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_history_url
+            ON download_history (video_url)
+        """)
+
+        # Уже загруженные в Telegram файлы: (id видео, формат) -> file_id
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS file_cache (
+                video_id TEXT,                  -- ID видео на YouTube
+                format TEXT,                    -- Формат/качество: mp3-192, 720p, ...
+                file_id TEXT,                   -- file_id, который вернул Telegram
+                media_type TEXT,                -- audio или video
+                created TEXT,
+                PRIMARY KEY (video_id, format)
+            )
+        """)
+
+        # Готовые файлы в downloads/cache (см. mediacache.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS media_cache (
+                key TEXT PRIMARY KEY,           -- id видео, формат и качество
+                video_id TEXT,
+                format TEXT,                    -- mp3, mp4
+                quality TEXT,                   -- битрейт или 720p, ...
+                path TEXT,
+                size INTEGER,
+                last_used REAL                  -- unix time
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_media_cache_last_used
+            ON media_cache (last_used)
+        """)
+
+        # Сессии пользователей (только при SESSION_PERSIST)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT,                      -- JSON с полями сессии
+                expires_at REAL                 -- unix time
+            )
+        """)
 
         conn.commit()
-        conn.close()
-        print("✅ База данных создана!")
-    else:
+    if db_exists:
         print("⚙️ База данных уже существует.")
+    else:
+        print("✅ База данных создана!")
+
+def close_db():
+    global _conn
+    flush_history()
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
 
 # Добавление нового пользователя
 def add_user(user_id, username, first_name):
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT OR IGNORE INTO users (id, username, first_name) 
-        VALUES (?, ?, ?)
-    """, (user_id, username, first_name))
-    conn.commit()
-    conn.close()
-
-# Добавление истории скачивания
-def add_download_to_history(user_id, video_title, video_url, file_path):
-    from datetime import datetime
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO download_history (user_id, video_title, video_url, file_path, download_date)
-        VALUES (?, ?, ?, ?, ?)
-    """, (user_id, video_title, video_url, file_path, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    with _lock:
+        conn = get_connection()
+        conn.execute(INSERT_USER, (user_id, username, first_name))
+        conn.commit()
+
+# Добавление истории скачивания: только кладём в буфер, на диск пишет flush_history
+def add_download_to_history(user_id, video_title, video_url, file_path, file_size=None, duration=None):
+    _start_flusher()
+    with _history_lock:
+        _history_buffer.append((user_id, video_title, video_url, file_path, _now(), file_size, duration))
+        if len(_history_buffer) >= HISTORY_BATCH_ROWS:
+            _flush_event.set()
+
+# Запись накопленной истории одной транзакцией
+def flush_history():
+    global _history_buffer
+    with _history_lock:
+        rows, _history_buffer = _history_buffer, []
+    if not rows:
+        return 0
+    with _lock:
+        conn = get_connection()
+        with conn:
+            conn.executemany(INSERT_HISTORY, rows)
+    return len(rows)
+
+def _flush_loop():
+    while True:
+        _flush_event.wait(HISTORY_FLUSH_MS / 1000)
+        _flush_event.clear()
+        try:
+            flush_history()
+        except sqlite3.Error as e:
+            print(f"History flush error: {e}")
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None:
+        with _history_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name="db-history", daemon=True)
+                _flusher.start()
+
+atexit.register(flush_history)
+
+# История скачиваний пользователя, новые сверху
+def get_user_history(user_id, limit=20):
+    flush_history()
+    with _lock:
+        cursor = get_connection().execute("""
+            SELECT video_title, video_url, file_path, download_date
+            FROM download_history
+            WHERE user_id = ?
+            ORDER BY download_date DESC
+            LIMIT ?
+        """, (user_id, limit))
+        return cursor.fetchall()
+
+# Самые скачиваемые видео (since — дата в формате "%Y-%m-%d %H:%M:%S")
+def get_top_videos(limit=10, since=None):
+    flush_history()
+    with _lock:
+        cursor = get_connection().execute("""
+            SELECT video_url, MAX(video_title), COUNT(*) AS downloads
+            FROM download_history
+            WHERE download_date >= ?
+            GROUP BY video_url
+            ORDER BY downloads DESC
+            LIMIT ?
+        """, (since or "", limit))
+        return cursor.fetchall()
+
+# Сколько пользователь скачал с момента since: (байт, секунд)
+def get_usage_since(user_id, since):
+    flush_history()
+    with _lock:
+        cursor = get_connection().execute("""
+            SELECT COALESCE(SUM(file_size), 0), COALESCE(SUM(duration), 0)
+            FROM download_history
+            WHERE user_id = ? AND download_date >= ?
+        """, (user_id, since))
+        return cursor.fetchone()
+
+# Поиск file_id в кэше
+def get_cached_file(video_id, fmt):
+    with _lock:
+        row = get_connection().execute(SELECT_CACHED_FILE, (video_id, fmt)).fetchone()
+    cache_stats["hits" if row else "misses"] += 1
+    return row[0] if row else None
+
+# Сохранение file_id после отправки файла
+def cache_file(video_id, fmt, file_id, media_type):
+    with _lock:
+        conn = get_connection()
+        conn.execute(INSERT_CACHED_FILE, (video_id, fmt, file_id, media_type, _now()))
+        conn.commit()
+
+# Удаление записей из кэша (всех форматов, если fmt не указан)
+def invalidate_cached_file(video_id, fmt=None):
+    with _lock:
+        conn = get_connection()
+        if fmt is None:
+            cursor = conn.execute("DELETE FROM file_cache WHERE video_id = ?", (video_id,))
+        else:
+            cursor = conn.execute("DELETE FROM file_cache WHERE video_id = ? AND format = ?", (video_id, fmt))
+        conn.commit()
+        return cursor.rowcount
+
+# Статистика кэша: попадания/промахи и число записей
+def get_cache_stats():
+    with _lock:
+        entries = get_connection().execute("SELECT COUNT(*) FROM file_cache").fetchone()[0]
+    return {**cache_stats, "entries": entries}
+
+# Индекс медиакэша: (путь, размер) по ключу
+def get_media_entry(key):
+    with _lock:
+        return get_connection().execute("SELECT path, size FROM media_cache WHERE key = ?", (key,)).fetchone()
+
+def touch_media_entry(key, last_used):
+    with _lock:
+        conn = get_connection()
+        conn.execute("UPDATE media_cache SET last_used = ? WHERE key = ?", (last_used, key))
+        conn.commit()
+
+def put_media_entry(key, video_id, fmt, quality, path, size, last_used):
+    with _lock:
+        conn = get_connection()
+        conn.execute("""
+            INSERT OR REPLACE INTO media_cache (key, video_id, format, quality, path, size, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (key, video_id, fmt, quality, path, size, last_used))
+        conn.commit()
+
+def delete_media_entry(key):
+    with _lock:
+        conn = get_connection()
+        conn.execute("DELETE FROM media_cache WHERE key = ?", (key,))
+        conn.commit()
+
+def get_media_total():
+    with _lock:
+        return get_connection().execute("SELECT COALESCE(SUM(size), 0) FROM media_cache").fetchone()[0]
+
+# Все записи медиакэша, давно не использованные первыми
+def get_media_entries():
+    with _lock:
+        cursor = get_connection().execute("SELECT key, path, size FROM media_cache ORDER BY last_used")
+        return cursor.fetchall()
+
+# Сохранение всех живых сессий (заменяет предыдущий снимок)
+def save_sessions(rows):
+    with _lock:
+        conn = get_connection()
+        with conn:
+            conn.execute("DELETE FROM sessions")
+            conn.executemany("INSERT INTO sessions (user_id, data, expires_at) VALUES (?, ?, ?)", rows)
+
+# Сохранённые сессии, самые давние первыми
+def load_sessions():
+    with _lock:
+        cursor = get_connection().execute("SELECT data, expires_at FROM sessions ORDER BY expires_at")
+        return cursor.fetchall()
@@ -0,0 +1,261 @@
+# downloader.py
+# Блокирующие задачи yt-dlp. Выполняются в пуле из workers.py, поэтому это
+# функции уровня модуля, которые принимают и возвращают только простые данные
+# (их можно передать и в отдельный процесс).
+# yt_dlp импортируется при первой задаче или заранее из warm_up() в фоне,
+# чтобы не задерживать запуск бота.
+import glob
+import os
+import re
+import threading
+import time
+import formats
+
+VIDEO_ID_RE = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([\w-]{11})")
+PLAYLIST_RE = re.compile(r"youtube\.com/playlist\?(?:\S*&)?list=[\w-]+")
+
+
+def video_id_from_url(url):
+    # ID видео без обращения к YouTube; None, если в ссылке его не видно
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def is_playlist_url(url):
+    # Только ссылки на сам плейлист; watch?v=...&list=... остаётся одним видео
+    return bool(PLAYLIST_RE.search(url))
+
+
+# Экстракторы, которые нужны боту: видео, youtu.be со списком, плейлисты.
+# Остальные ~1800 add_default_info_extractors() не загружаем; если YouTube
+# отдаст ссылку на другой экстрактор, yt-dlp подгрузит его сам по ie_key.
+YOUTUBE_EXTRACTORS = ("YoutubeIE", "YoutubeYtBeIE", "YoutubePlaylistIE", "YoutubeTabIE")
+
+_yt_dlp = None
+_extractors = None
+_import_lock = threading.Lock()
+
+
+def _load():
+    global _yt_dlp, _extractors
+    with _import_lock:
+        if _extractors is None:
+            import yt_dlp
+            from yt_dlp.extractor import youtube
+            _yt_dlp = yt_dlp
+            _extractors = [getattr(youtube, name) for name in YOUTUBE_EXTRACTORS if hasattr(youtube, name)]
+    return _yt_dlp
+
+
+def warm_up():
+    # Импорт yt_dlp и экстракторов YouTube до первой ссылки; блокирующая
+    started = time.monotonic()
+    _load()
+    return time.monotonic() - started
+
+
+def YoutubeDL(params):
+    yt_dlp = _load()
+    ydl = yt_dlp.YoutubeDL(params, auto_init=False)
+    for extractor in _extractors:
+        ydl.add_info_extractor(extractor())
+    return ydl
+
+
+# Поля, которые не нужны для загрузки, но занимают основную часть info
+PROBE_DROP_KEYS = ("automatic_captions", "subtitles", "thumbnails", "heatmap")
+
+
+def probe(url):
+    with YoutubeDL({"quiet": True, "noplaylist": True}) as ydl:
+        info = ydl.extract_info(url, download=False)
+        info = ydl.sanitize_info(info)
+
+    for key in PROBE_DROP_KEYS:
+        info.pop(key, None)
+    return info
+
+
+def list_entries(url, limit):
+    # Видео плейлиста без захода на страницу каждого: ссылка, название, длительность
+    opts = {"quiet": True, "extract_flat": "in_playlist", "playlistend": limit}
+    with YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    entries = info.get("entries") if info.get("_type") == "playlist" else [info]
+    return [
+        {
+            "url": entry.get("url") or entry.get("webpage_url"),
+            "id": entry.get("id"),
+            "title": entry.get("title"),
+            "duration": entry.get("duration"),
+        }
+        for entry in list(entries or [])[:limit] if entry
+    ]
+
+
+def _extract(ydl, url, info):
+    # Есть результат probe — пропускаем повторное извлечение и сразу
+    # выбираем форматы и скачиваем (как yt-dlp --load-info-json).
+    if info is not None:
+        try:
+            return ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=True)
+        except _yt_dlp.utils.DownloadError as e:
+            # Ссылки на форматы могли устареть — извлекаем заново
+            print(f"Cached info failed, extracting again: {e}")
+    return ydl.extract_info(url, download=True)
+
+
+class DiskUsage:
+    # Пиковый объём файлов задачи в downloads/ (исходники, .part, результат),
+    # замеряется фоновым потоком раз в interval секунд
+    def __init__(self, pattern, interval=0.2):
+        self.pattern = pattern
+        self.interval = interval
+        self.peak = 0
+        self.started = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="disk-usage", daemon=True)
+
+    def _sample(self):
+        total = 0
+        for path in glob.glob(self.pattern):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        self.peak = max(self.peak, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def stats(self, size):
+        # В дисковом режиме отправка начинается только после записи файла
+        elapsed = time.monotonic() - self.started
+        return {
+            "mode": "disk",
+            "ttfb": elapsed,
+            "upload_start": elapsed,
+            "peak_disk": self.peak,
+            "size": size,
+        }
+
+
+class StageTimer:
+    # Сколько внутри одного вызова yt-dlp заняла сама загрузка и сколько —
+    # постобработка ffmpeg (склейка, конвертация), по хукам yt-dlp
+    def __init__(self):
+        self.started = time.monotonic()
+        self.downloaded = None
+        self.postprocess = 0.0
+        self._pp_started = None
+
+    def progress_hook(self, d):
+        if d["status"] == "finished":
+            self.downloaded = time.monotonic()
+
+    def postprocessor_hook(self, d):
+        if d["status"] == "started":
+            self._pp_started = time.monotonic()
+        elif d["status"] == "finished" and self._pp_started is not None:
+            self.postprocess += time.monotonic() - self._pp_started
+            self._pp_started = None
+
+    def timings(self):
+        download_end = self.downloaded or time.monotonic()
+        return {"download": download_end - self.started, "postprocess": self.postprocess}
+
+
+def _add_hooks(ydl_opts, timer, progress):
+    # progress — progress.ProgressReporter; только для пула потоков
+    ydl_opts["progress_hooks"] = [timer.progress_hook]
+    ydl_opts["postprocessor_hooks"] = [timer.postprocessor_hook]
+    if progress is not None:
+        ydl_opts["progress_hooks"].append(progress.ytdl_hook)
+        ydl_opts["postprocessor_hooks"].append(progress.postprocessor_hook)
+
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def fetch_video(url, height, prefix, info=None, progress=None):
+    # Форматы выбираются по probe (formats.py): ffmpeg запускается, только
+    # когда готового MP4 с H.264/AAC в этом качестве нет
+    plan = formats.plan_video(info, height)
+    ydl_opts = {
+        'format': plan["format"],
+        'outtmpl': f'downloads/{prefix}_%(title)s.%(ext)s',
+    }
+    if plan["path"] != "copy":
+        ydl_opts['merge_output_format'] = 'mp4'
+    if plan["path"] in ("transcode", "auto"):
+        ydl_opts['postprocessors'] = [{
+            'key': 'FFmpegVideoConvertor',
+            'preferedformat': 'mp4',
+        }]
+
+    timer = StageTimer()
+    _add_hooks(ydl_opts, timer, progress)
+
+    with DiskUsage(f"downloads/{glob.escape(str(prefix))}_*") as disk:
+        with YoutubeDL(ydl_opts) as ydl:
+            info = _extract(ydl, url, info)
+            file_path = ydl.prepare_filename(info)
+
+        if not file_path.endswith('.mp4'):
+            file_path = file_path.rsplit('.', 1)[0] + '.mp4'
+
+    return {
+        "file_path": file_path,
+        "title": info.get('title'),
+        "duration": info.get('duration'),
+        "stats": {
+            **disk.stats(_file_size(file_path)), "timings": timer.timings(),
+            "path": plan["path"], "format": info.get("format_id"),
+        },
+    }
+
+
+def fetch_mp3(url, prefix, info=None, progress=None, codec="mp3", bitrate="192"):
+    # codec="m4a" — исходная AAC-дорожка как есть, если она есть (formats.py)
+    plan = formats.plan_audio(info, codec)
+    ydl_opts = {
+        "format": plan["format"],
+        "outtmpl": f"downloads/{prefix}_%(title)s.%(ext)s",
+    }
+    if plan["path"] != "copy":
+        # Для m4a из AAC FFmpegExtractAudio сам делает -c copy
+        ydl_opts["postprocessors"] = [{
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": codec,
+            "preferredquality": bitrate,
+        }]
+
+    timer = StageTimer()
+    _add_hooks(ydl_opts, timer, progress)
+
+    with DiskUsage(f"downloads/{glob.escape(str(prefix))}_*") as disk:
+        with YoutubeDL(ydl_opts) as ydl:
+            info = _extract(ydl, url, info)
+            file_name = os.path.splitext(ydl.prepare_filename(info))[0] + "." + codec
+
+    return {
+        "file_name": file_name,
+        "title": info.get('title'),
+        "stats": {
+            **disk.stats(_file_size(file_name)), "timings": timer.timings(),
+            "path": plan["path"], "format": info.get("format_id"),
+        },
+    }
@@ -0,0 +1,98 @@
+# formats.py
+# Выбор форматов YouTube по списку formats из probe так, чтобы ffmpeg
+# работал как можно меньше. Telegram сам воспроизводит MP4 с H.264 (avc1)
+# и AAC (mp4a), поэтому в пределах выбранного качества порядок такой:
+#   copy      — готовый файл нужного вида: ffmpeg не запускается;
+#   remux     — отдельные дорожки avc1 и mp4a склеиваются в MP4 без
+#               перекодирования (-c copy);
+#   transcode — совместимых дорожек нет: как раньше, bestvideo+bestaudio,
+#               склейка и FFmpegVideoConvertor; для MP3 — всегда.
+#   auto      — probe нет: то же предпочтение строкой формата, выбирает yt-dlp.
+# Путь задачи попадает в её JSON-строку в логе и в bot_media_path_total.
+
+# Префиксы кодеков в полях vcodec/acodec yt-dlp
+AVC_CODECS = ("avc1", "h264")
+AAC_CODECS = ("mp4a", "aac")
+# Форматы, которые скачиваются одним файлом (как DIRECT_PROTOCOLS в
+# streaming.py). HLS/DASH (m3u8_native, http_dash_segments) собираются из
+# сегментов через ffmpeg или ломают copy, поэтому их не выбираем.
+HTTP_PROTOCOLS = ("https", "http")
+
+
+def _is_video(fmt):
+    return fmt.get("vcodec") not in (None, "none")
+
+
+def _is_audio(fmt):
+    return fmt.get("acodec") not in (None, "none")
+
+
+def _is_http(fmt):
+    return fmt.get("protocol", "https") in HTTP_PROTOCOLS
+
+
+def _codec(fmt, field):
+    return (fmt.get(field) or "").lower()
+
+
+def is_avc(fmt):
+    return _codec(fmt, "vcodec").startswith(AVC_CODECS)
+
+
+def is_aac(fmt):
+    return _codec(fmt, "acodec").startswith(AAC_CODECS)
+
+
+def _rate(fmt):
+    return fmt.get("tbr") or fmt.get("vbr") or fmt.get("abr") or 0
+
+
+def plan_video(info, height):
+    # -> {"format": строка формата для yt-dlp, "path": ..., "height": ...}
+    height = int(height)
+    formats = (info or {}).get("formats") or []
+    videos = [fmt for fmt in formats if _is_video(fmt) and 0 < (fmt.get("height") or 0) <= height]
+    if not videos:
+        return {
+            "format": (
+                f"best[height<={height}][vcodec^=avc1][acodec^=mp4a][ext=mp4]"
+                f"/bestvideo[height<={height}][vcodec^=avc1]+bestaudio[acodec^=mp4a]"
+                f"/bestvideo[height<={height}]+bestaudio/best[height<={height}]"
+            ),
+            "path": "auto",
+            "height": None,
+        }
+
+    # Качество не понижаем ради совместимости: выбираем только среди лучшей высоты
+    best_height = max(fmt["height"] for fmt in videos)
+    tier = [fmt for fmt in videos if fmt["height"] == best_height and _is_http(fmt)]
+
+    progressive = [fmt for fmt in tier if is_avc(fmt) and is_aac(fmt) and fmt.get("ext") == "mp4"]
+    if progressive:
+        return {"format": max(progressive, key=_rate)["format_id"], "path": "copy", "height": best_height}
+
+    avc = [fmt for fmt in tier if is_avc(fmt) and not _is_audio(fmt)]
+    aac = [fmt for fmt in formats if is_aac(fmt) and not _is_video(fmt) and _is_http(fmt)]
+    if avc and aac:
+        video = max(avc, key=_rate)
+        audio = max(aac, key=_rate)
+        return {"format": f"{video['format_id']}+{audio['format_id']}", "path": "remux", "height": best_height}
+
+    return {
+        "format": f"bestvideo[height<={height}]+bestaudio/best[height<={height}]",
+        "path": "transcode",
+        "height": best_height,
+    }
+
+
+def plan_audio(info, codec="mp3"):
+    # codec — в каком виде отправляем: "mp3" или "m4a" (AUDIO_PASSTHROUGH).
+    # MP3 у YouTube нет, поэтому для него всегда transcode.
+    formats = (info or {}).get("formats") or []
+    if codec == "m4a":
+        aac = [fmt for fmt in formats if is_aac(fmt) and not _is_video(fmt) and _is_http(fmt)]
+        if aac:
+            return {"format": max(aac, key=_rate)["format_id"], "path": "copy"}
+        if not formats:
+            return {"format": "bestaudio[acodec^=mp4a]/bestaudio/best", "path": "auto"}
+    return {"format": "bestaudio/best", "path": "transcode"}
@@ -0,0 +1,249 @@
+# jobqueue.py
+# Очередь задач между фронтом (main.py принимает апдейты Telegram) и
+# процессами worker.py (качают, конвертируют, отправляют). Задача — вид
+# (kind) и JSON с простыми данными.
+#
+# SQLiteBroker — долговечная очередь в отдельной базе: задачи переживают
+# перезапуск, а задачу упавшего воркера после окончания аренды (lease)
+# забирает другой. LocalBroker — то же в памяти одного процесса, для
+# тестов и бенчмарков. Другой брокер (Redis и т. п.) должен реализовать
+# методы Broker.
+import asyncio
+import itertools
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+
+
+class Broker:
+    def put(self, kind, payload):
+        # -> id задачи
+        raise NotImplementedError
+
+    def claim(self, worker, lease):
+        # -> (id, kind, payload) или None, если задач нет
+        raise NotImplementedError
+
+    def extend(self, job_id, lease):
+        raise NotImplementedError
+
+    def complete(self, job_id):
+        raise NotImplementedError
+
+    def fail(self, job_id, error):
+        raise NotImplementedError
+
+    def counts(self):
+        # -> {статус: число задач}
+        raise NotImplementedError
+
+
+class SQLiteBroker(Broker):
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            # isolation_level=None: транзакции открываем сами (BEGIN IMMEDIATE)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT,
+                    payload TEXT,               -- JSON
+                    status TEXT,                -- queued, running, done, failed
+                    worker TEXT,
+                    lease_until REAL,           -- unix time; потом задачу можно забрать
+                    attempts INTEGER DEFAULT 0,
+                    error TEXT,
+                    created REAL,
+                    updated REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+        return self._conn
+
+    def put(self, kind, payload):
+        now = time.time()
+        with self._lock:
+            cursor = self._connection().execute(
+                "INSERT INTO jobs (kind, payload, status, created, updated) VALUES (?, ?, 'queued', ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker, lease):
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            # IMMEDIATE: два воркера не заберут одну задачу
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = conn.execute("""
+                        SELECT id, kind, payload, attempts FROM jobs
+                        WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)
+                        ORDER BY id LIMIT 1
+                    """, (now,)).fetchone()
+                    if row is None:
+                        conn.execute("COMMIT")
+                        return None
+                    job_id, kind, payload, attempts = row
+                    if attempts >= self.max_attempts:
+                        # Воркеры падают на этой задаче снова и снова
+                        conn.execute(
+                            "UPDATE jobs SET status = 'failed', error = 'too many attempts', updated = ? WHERE id = ?",
+                            (now, job_id)
+                        )
+                        continue
+                    conn.execute("""
+                        UPDATE jobs SET status = 'running', worker = ?, lease_until = ?,
+                            attempts = attempts + 1, updated = ?
+                        WHERE id = ?
+                    """, (worker, now + lease, now, job_id))
+                    conn.execute("COMMIT")
+                    return job_id, kind, json.loads(payload)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def extend(self, job_id, lease):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'", (time.time() + lease, job_id)
+            )
+
+    def _finish(self, job_id, status, error=None):
+        with self._lock:
+            self._connection().execute(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?", (status, error, time.time(), job_id)
+            )
+
+    def complete(self, job_id):
+        self._finish(job_id, "done")
+
+    def fail(self, job_id, error):
+        self._finish(job_id, "failed", error)
+
+    def counts(self):
+        with self._lock:
+            rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def purge(self, older_than):
+        # Удаление выполненных и упавших задач старше older_than секунд
+        with self._lock:
+            cursor = self._connection().execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?", (time.time() - older_than,)
+            )
+            return cursor.rowcount
+
+
+class LocalBroker(Broker):
+    # Очередь в памяти процесса с тем же поведением (аренда, повторы)
+    def __init__(self, max_attempts=3):
+        self.max_attempts = max_attempts
+        self._ids = itertools.count(1)
+        self._queue = deque()
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def put(self, kind, payload):
+        with self._lock:
+            job_id = next(self._ids)
+            # Через JSON, как в SQLiteBroker: несериализуемые данные видны сразу
+            self._jobs[job_id] = {"kind": kind, "payload": json.dumps(payload), "status": "queued", "attempts": 0}
+            self._queue.append(job_id)
+            return job_id
+
+    def claim(self, worker, lease):
+        now = time.time()
+        with self._lock:
+            for job_id, job in self._jobs.items():
+                if job["status"] == "running" and job["lease_until"] < now:
+                    job["status"] = "queued"
+                    self._queue.appendleft(job_id)
+            while self._queue:
+                job_id = self._queue.popleft()
+                job = self._jobs[job_id]
+                if job["status"] != "queued":
+                    continue
+                if job["attempts"] >= self.max_attempts:
+                    job.update(status="failed", error="too many attempts")
+                    continue
+                job.update(status="running", worker=worker, lease_until=now + lease, attempts=job["attempts"] + 1)
+                return job_id, job["kind"], json.loads(job["payload"])
+            return None
+
+    def extend(self, job_id, lease):
+        with self._lock:
+            self._jobs[job_id]["lease_until"] = time.time() + lease
+
+    def complete(self, job_id):
+        with self._lock:
+            self._jobs[job_id]["status"] = "done"
+
+    def fail(self, job_id, error):
+        with self._lock:
+            self._jobs[job_id].update(status="failed", error=error)
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+
+def open_broker(kind, path=None):
+    # JOB_BROKER из config.py; None — задачи выполняются прямо во фронте
+    if kind == "local":
+        return None
+    if kind == "sqlite":
+        return SQLiteBroker(path)
+    if kind == "memory":
+        return LocalBroker()
+    raise ValueError(f"Unknown job broker: {kind}")
+
+
+async def consume(broker, handlers, worker, concurrency=1, poll=0.5, lease=600, drain=False):
+    # Выполняет задачи брокера: handlers[kind](payload), concurrency штук
+    # одновременно. Пока задача идёт, аренда продлевается. drain=True —
+    # выйти, когда очередь опустела (для бенчмарков).
+    loop = asyncio.get_running_loop()
+
+    async def heartbeat(job_id):
+        while True:
+            await asyncio.sleep(lease / 3)
+            await loop.run_in_executor(None, broker.extend, job_id, lease)
+
+    async def slot():
+        while True:
+            job = await loop.run_in_executor(None, broker.claim, worker, lease)
+            if job is None:
+                if drain:
+                    return
+                await asyncio.sleep(poll)
+                continue
+
+            job_id, kind, payload = job
+            beat = asyncio.ensure_future(heartbeat(job_id))
+            try:
+                await handlers[kind](payload)
+            except Exception as e:
+                print(f"Job {job_id} ({kind}) failed: {e}")
+                await loop.run_in_executor(None, broker.fail, job_id, f"{type(e).__name__}: {e}")
+            else:
+                await loop.run_in_executor(None, broker.complete, job_id)
+            finally:
+                beat.cancel()
+
+    await asyncio.gather(*(slot() for _ in range(concurrency)))
@@ -1,19 +1,104 @@
 import os
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from config import API_ID, API_HASH, BOT_TOKEN
-from yt_dlp import YoutubeDL
-import eyed3
-from database import init_db, add_user, add_download_to_history
+import io
+import re
+import math
+import itertools
+import asyncio
+import time
+from pyrogram import Client, filters, idle
+from pyrogram.types import (
+    Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, InputMediaAudio, InputMediaVideo,
+)
+from config import (
+    API_ID, API_HASH, BOT_TOKEN,
+    DOWNLOAD_POOL, DOWNLOAD_WORKERS, DOWNLOADS_PER_USER, PROBE_WORKERS, ADMIN_IDS,
+    PROBE_CACHE_SIZE, PROBE_CACHE_TTL, STREAM_UPLOADS, STREAM_MAX_BYTES,
+    SESSION_MAX, SESSION_TTL, SESSION_PERSIST, METRICS_HOST, METRICS_PORT,
+    RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST, CHAT_RATE_LIMIT_PER_MINUTE, CHAT_RATE_LIMIT_BURST,
+    DAILY_QUOTA_BYTES, DAILY_QUOTA_MINUTES, BATCH_MAX_ITEMS, BATCH_CONCURRENCY, BATCH_MAX_BYTES,
+    MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MP3_TAG_RESERVE, JOB_BROKER, JOB_DB_PATH, AUDIO_PASSTHROUGH,
+    JOB_LEASE, WORKER_JOBS,
+)
+from database import (
+    init_db, run_db, add_user, add_download_to_history,
+    get_cached_file, cache_file, invalidate_cached_file, get_cache_stats, get_media_total,
+)
+from workers import DownloadQueue
+from cache import TTLCache
+from singleflight import SingleFlight, SharedFiles
+from sessions import Session, SessionStore
+from ratelimit import RateLimiter, DailyQuota
+import downloader
+import formats
+import streaming
+from progress import ProgressReporter
+from mediacache import MediaCache, clone
+import tagging
+import jobqueue
+import metrics
 
-# Initialize database
-init_db()
-
-# Initialize bot
+# Initialize bot (the database is set up in main(), while it connects)
 bot = Client("youtube_downloader_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 
-# User state dictionary
-user_states = {}
+# User sessions: bounded and expiring, see cleanup_session() for what an
+# expired or evicted session leaves behind
+user_states = SessionStore(SESSION_MAX, SESSION_TTL, persist=SESSION_PERSIST)
+
+# Worker pools: downloads are heavy and limited per user, probes are light
+download_queue = DownloadQueue(DOWNLOAD_WORKERS, DOWNLOADS_PER_USER, DOWNLOAD_POOL, name="download")
+probe_queue = DownloadQueue(PROBE_WORKERS, 1, DOWNLOAD_POOL, name="probe")
+
+# Recent extract_info results by video id, reused by the download jobs
+probe_cache = TTLCache(PROBE_CACHE_SIZE, PROBE_CACHE_TTL)
+
+# Identical jobs running at the same time are done once (see singleflight.py)
+flights = SingleFlight()
+shared_files = SharedFiles()
+
+# Converted MP3/MP4 files kept on disk, indexed in users.db (see mediacache.py)
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES)
+
+# None: jobs run in this process; otherwise they are queued for worker.py
+job_broker = jobqueue.open_broker(JOB_BROKER, JOB_DB_PATH)
+
+# Numbers the files this process writes to downloads/
+_file_ids = itertools.count()
+
+def cleanup_session(state):
+    release_mp3_file(state)
+    if state.file_path and os.path.exists(state.file_path):
+        os.remove(state.file_path)
+
+def restore_session(state):
+    # Shared file references do not survive a restart, take them again
+    if state.file_key and state.file_name:
+        shared_files.acquire(state.file_key)
+        shared_files.set_path(state.file_key, state.file_name)
+
+user_states.on_expire = cleanup_session
+
+# Per-user and per-chat request rate, daily bytes/minutes per user
+user_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+chat_limiter = RateLimiter(CHAT_RATE_LIMIT_PER_MINUTE, CHAT_RATE_LIMIT_BURST)
+# Workers record their downloads too, so with a broker re-read usage often
+quota = DailyQuota(DAILY_QUOTA_BYTES, DAILY_QUOTA_MINUTES, ttl=30 if job_broker else None)
+
+metrics.Gauge(
+    "bot_queue_waiting", "Jobs waiting for a worker", ["queue"],
+    fn=lambda: {("download",): download_queue.waiting, ("probe",): probe_queue.waiting}
+)
+metrics.Gauge(
+    "bot_queue_running", "Jobs running in the worker pool", ["queue"],
+    fn=lambda: {("download",): download_queue.active, ("probe",): probe_queue.active}
+)
+metrics.Gauge("bot_sessions", "Live user sessions", fn=lambda: len(user_states))
+metrics.Gauge("bot_media_cache_bytes", "Size of the converted files cache", fn=get_media_total)
+if job_broker is not None:
+    metrics.Gauge(
+        "bot_job_queue", "Jobs in the shared queue by status", ["status"],
+        fn=lambda: {(status,): count for status, count in job_broker.counts().items()}
+    )
+rejected = metrics.Counter("bot_rejected_total", "Requests refused by the rate limiter or quota", ["reason"])
 
 # Available video quality options
 VIDEO_QUALITIES = {
@@ -23,25 +108,61 @@ VIDEO_QUALITIES = {
     "1080p": "1080"
 }
 
+# Audio as sent and its key in the file_id and media caches: MP3, or with
+# AUDIO_PASSTHROUGH the source AAC track in .m4a without ffmpeg (see formats.py)
+MP3_BITRATE = "192"
+AUDIO_EXT, AUDIO_QUALITY = ("m4a", "source") if AUDIO_PASSTHROUGH else ("mp3", MP3_BITRATE)
+AUDIO_FORMAT = f"{AUDIO_EXT}-{AUDIO_QUALITY}"
+
+# Longest video accepted, for a single link and for each item of a batch
+MAX_DURATION = 20 * 60
+
+# All YouTube links in a message; more than one (or a playlist) is a batch
+YOUTUBE_LINK_RE = re.compile(r"https?://(?:www\.|m\.|music\.)?(?:youtube\.com|youtu\.be)/\S+")
+
+# Telegram accepts 2 to 10 files per media group
+MEDIA_GROUP_SIZE = 10
+
 def set_mp3_tags(file_path, title, artist):
+    # Blocking (file write): call through run_blocking(). The cover is already
+    # in the file if it is a clone from the media cache (see prepare_cached_mp3)
+    if not file_path.endswith(".mp3"):
+        # m4a passthrough: Telegram shows the title/performer given to reply_audio
+        return True
     try:
-        audiofile = eyed3.load(file_path)
-        if audiofile and audiofile.tag:
-            audiofile.tag.title = title
-            audiofile.tag.artist = artist
-            audiofile.tag.save()
-        else:
-            audiofile = eyed3.load(file_path)
-            if audiofile.tag is None:
-                audiofile.initTag()
-            audiofile.tag.title = title
-            audiofile.tag.artist = artist
-            audiofile.tag.save()
+        tagging.write_tags(file_path, title, artist)
         return True
     except Exception as e:
+        # The file still goes out, with the tags it had
         print(f"Tag error: {e}")
+        metrics.stage_errors.inc(stage="tagging", type=type(e).__name__)
         return False
 
+def prepare_cached_mp3(file_path, video_id, cover=None):
+    # Blocking (cover download, file rewrite): before a fresh MP3 goes into the
+    # media cache. The cover is fetched once per video and stored with the tag
+    # padding, so every clone tagged later keeps it without another request.
+    tagging.reserve(file_path, MP3_TAG_RESERVE, cover or tagging.fetch_cover(video_id))
+
+def store_streamed_audio(data, video_id, title, artist, cover=None):
+    # Blocking (file write): a streamed MP3/M4A is written out once more for
+    # the media cache, with the video's own tags, so the next request (any
+    # tags) gets a clone instead of another download and transcode
+    # Nothing may have created downloads/ yet: streaming doesn't go through yt-dlp
+    os.makedirs("downloads", exist_ok=True)
+    file_path = os.path.join("downloads", f"{unique_prefix(f'stream-{video_id}')}.{AUDIO_EXT}")
+    with open(file_path, "wb") as f:
+        f.write(data)
+    if AUDIO_EXT == "mp3":
+        prepare_cached_mp3(file_path, video_id, cover)
+        tagging.write_tags(file_path, title, artist)
+    return file_path
+
+async def run_blocking(fn, *args):
+    # Short blocking work (tags, file copies) off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, fn, *args)
+
 def get_main_keyboard():
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("ℹ️ О боте", callback_data="about")],
@@ -61,93 +182,694 @@ def get_video_quality_keyboard():
     buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="back_to_format")])
     return InlineKeyboardMarkup(buttons)
 
-async def download_video(url, quality, message, user_id):
-    progress_msg = await message.edit_text(f"🎬 Загружаю видео в {quality}...")
-    
+def get_batch_keyboard():
+    buttons = [[InlineKeyboardButton("🎵 Всё в MP3", callback_data="batch_mp3")]]
+    for quality in VIDEO_QUALITIES.keys():
+        buttons.append([InlineKeyboardButton(f"🎬 Видео {quality}", callback_data=f"batch_{quality}")])
+    return InlineKeyboardMarkup(buttons)
+
+async def probe_video(url, user_id, limit=None):
+    key = downloader.video_id_from_url(url) or url
+    info = probe_cache.get(key)
+    metrics.cache_lookup("probe", info is not None)
+    if info is not None:
+        return info
+
+    # Users pasting the same link at the same time share one extraction
+    async def probe_job():
+        info = await probe_queue.run(user_id, downloader.probe, url, limit=limit)
+        probe_cache.set(info.get("id") or key, info)
+        return info
+
+    info, _ = await flights.run(("probe", key), probe_job)
+    return info
+
+def unique_prefix(name):
+    # downloads/ is shared by all worker processes, and SingleFlight only joins
+    # identical jobs within one process: output names (and the DiskUsage glob
+    # of yt-dlp jobs) need this process's pid and a number of their own
+    return f"{name}-{os.getpid()}-{next(_file_ids)}"
+
+def named_buffer(data, name):
+    # pyrogram uploads file-like objects and takes the file name from .name
+    buffer = io.BytesIO(data)
+    buffer.name = name
+    return buffer
+
+def private_copy(path, user_id, title=None):
+    # Cached and shared files are never tagged in place: each user gets their
+    # own copy (a reflink where the filesystem supports it), named after the title
+    name = os.path.basename(path)
+    if title:
+        name = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", title)[:100] + os.path.splitext(path)[1]
+    return clone(path, os.path.join("downloads", f"{unique_prefix(user_id)}_{name}"))
+
+async def lookup_media(video_id, fmt, quality):
+    if not video_id:
+        return None
+    path = await run_db(media_cache.get, video_id, fmt, quality)
+    metrics.cache_lookup("media", path is not None)
+    return path
+
+async def run_download(job, user_id, fn, *args, **kwargs):
+    # Download job in the pool; its stats and timings go to the job log, a
+    # failure (yt-dlp DownloadError, ffmpeg, HTTP) to bot_errors_total
+    stage = "stream" if fn in (streaming.stream_file, streaming.stream_mp3) else "download"
+    started = time.monotonic()
     try:
-        ydl_opts = {
-            'format': f'bestvideo[height<={VIDEO_QUALITIES[quality]}]+bestaudio/best[height<={VIDEO_QUALITIES[quality]}]',
-            'merge_output_format': 'mp4',
-            'outtmpl': f'downloads/{user_id}_%(title)s.%(ext)s',
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }]
-        }
-
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            file_path = ydl.prepare_filename(info)
-            
-            if not file_path.endswith('.mp4'):
-                file_path = file_path.rsplit('.', 1)[0] + '.mp4'
+        result = await download_queue.run(user_id, fn, *args, **kwargs)
+    except Exception as e:
+        metrics.stage_errors.inc(stage=stage, type=type(e).__name__)
+        raise
+    job.transfer(result["stats"], time.monotonic() - started)
+    return result
 
-            duration = info.get('duration')
-            title = info.get('title')
-            
-            await progress_msg.edit_text("📤 Отправляю видео...")
+async def lookup_file_id(video_id, fmt):
+    if not video_id:
+        return None
+    file_id = await run_db(get_cached_file, video_id, fmt)
+    metrics.cache_lookup("file_id", file_id is not None)
+    return file_id
+
+async def check_limits(message, user_id, duration=0, rate=True):
+    # Refusal text or None; runs before any yt-dlp work
+    if user_id in ADMIN_IDS:
+        return None
+    if rate:
+        wait = user_limiter.acquire(user_id)
+        if not wait and message.chat:
+            wait = chat_limiter.acquire(message.chat.id)
+        if wait:
+            rejected.inc(reason="rate")
+            return f"⏳ Слишком много запросов. Попробуйте через {math.ceil(wait)} сек."
+    refusal = await quota.check(user_id, duration)
+    if refusal:
+        rejected.inc(reason="quota")
+        return f"{refusal}\nПопробуйте завтра."
+    return None
+
+def record_download(user_id, title, url, kind, sent, duration):
+    # sent is the uploaded message, its media carries the size Telegram stored
+    media = (sent.video or sent.audio) if sent else None
+    size = media.file_size if media else None
+    add_download_to_history(user_id, title, url, kind, size, duration)
+    quota.add(user_id, size, duration)
+
+def worker_progress(progress):
+    # Hooks are plain callbacks, they can't be sent to another process
+    return progress if DOWNLOAD_POOL == "thread" else None
+
+def queue_notifier(message, text):
+    async def notify(position):
+        await message.edit_text(f"{text}\n\n⏳ Вы в очереди: позиция {position}")
+    return notify
+
+async def download_video(url, quality, message, user_id, title, video_id, duration=None):
+    progress_msg = await message.edit_text(f"🎬 Загружаю видео в {quality}...")
+    caption = (
+        f"🎬 **{{title}}**\n"
+        f"📺 Качество: {quality}\n\n"
+        "Скачано с помощью @SoundsBot_KB"
+    )
+
+    # The job is finished (as an error) on any exit, cancellation included,
+    # so bot_active_jobs never leaks
+    with metrics.Job("video", user_id=user_id, video_id=video_id, quality=quality) as job:
+        # Already uploaded once: re-send by file_id, no download at all
+        cached_file_id = await lookup_file_id(video_id, quality)
+        if cached_file_id:
+            try:
+                await progress_msg.edit_text("📤 Отправляю видео...")
+                with job.stage("upload"):
+                    sent = await message.reply_video(
+                        video=cached_file_id,
+                        caption=caption.format(title=title),
+                        supports_streaming=True
+                    )
+                record_download(user_id, title, url, "video", sent, duration)
+                job.fields["source"] = "file_id"
+                job.finish()
+                return True
+            except Exception as e:
+                print(f"Cached file_id failed, downloading again: {e}")
+                await run_db(invalidate_cached_file, video_id, quality)
+
+        # The first request downloads and uploads, identical requests made
+        # meanwhile wait for it and re-send the uploaded file_id
+        async def produce_video():
+            notify = queue_notifier(progress_msg, f"🎬 Загружаю видео в {quality}...")
+            info = probe_cache.get(video_id)
+            file_path = None
+            video_title = title
+            cached_path = await lookup_media(video_id, "mp4", quality)
+
+            # A ready-made MP4 at this quality goes to Telegram from memory;
+            # anything that needs a merge/remux goes through downloads/
+            stream_fmt = None
+            if STREAM_UPLOADS and info and not cached_path:
+                stream_fmt = streaming.pick_video_format(info, int(VIDEO_QUALITIES[quality]), STREAM_MAX_BYTES)
+
+            try:
+                async with ProgressReporter(progress_msg, f"🎬 Загружаю видео в {quality}...") as progress:
+                    if cached_path:
+                        video = cached_path
+                        duration = info.get("duration") if info else None
+                        job.fields["source"] = "media_cache"
+                    elif stream_fmt:
+                        result = await run_download(
+                            job, user_id, streaming.stream_file, stream_fmt, STREAM_MAX_BYTES,
+                            worker_progress(progress),
+                            on_queued=notify
+                        )
+                        video = named_buffer(result["data"], f"{title}.mp4")
+                        duration = info.get("duration")
+                    else:
+                        result = await run_download(
+                            job, user_id, downloader.fetch_video, url, VIDEO_QUALITIES[quality],
+                            unique_prefix(f"{quality}-{video_id or user_id}"), info, worker_progress(progress),
+                            on_queued=notify
+                        )
+                        video = file_path = result["file_path"]
+                        duration = result["duration"]
+                        video_title = result["title"]
+                        if video_id:
+                            # Kept for the next request instead of being removed after the upload
+                            video = await run_db(media_cache.put, video_id, "mp4", quality, file_path)
+                            file_path = None
+
+                    progress.stage("upload")
+
+                    with job.stage("upload"):
+                        sent = await message.reply_video(
+                            video=video,
+                            duration=duration,
+                            caption=caption.format(title=video_title),
+                            supports_streaming=True,
+                            file_name=f"{video_title}.mp4",
+                            progress=progress.upload
+                        )
+            finally:
+                if file_path and os.path.exists(file_path):
+                    os.remove(file_path)
+
+            file_id = sent.video.file_id if sent and sent.video else None
+            if video_id and file_id:
+                await run_db(cache_file, video_id, quality, file_id, "video")
+            return {"file_id": file_id, "title": video_title, "sent": sent}
+
+        try:
+            result, joined = await flights.run((video_id or url, quality), produce_video)
+            sent = result["sent"]
+            if joined:
+                await progress_msg.edit_text("📤 Отправляю видео...")
+                with job.stage("upload"):
+                    sent = await message.reply_video(
+                        video=result["file_id"],
+                        caption=caption.format(title=result["title"]),
+                        supports_streaming=True
+                    )
+                job.fields["source"] = "joined"
+
+            record_download(user_id, result["title"], url, "video", sent, duration)
+            job.finish()
+            return True
             
-            await message.reply_video(
-                video=file_path,
-                duration=duration,
-                caption=f"🎬 **{title}**\n"
-                        f"📺 Качество: {quality}\n\n"
-                        "Скачано с помощью @SoundsBot_KB",
-                supports_streaming=True
+        except Exception as e:
+            job.finish("error", e)
+            await progress_msg.edit_text(f"❌ Ошибка при загрузке: {str(e)}")
+            return False
+
+async def convert_mp3(job, url, message, user_id, video_id):
+    async with ProgressReporter(message, "🎵 Загружаю MP3...") as progress:
+        result = await run_download(
+            job, user_id, downloader.fetch_mp3, url, unique_prefix(f"mp3-{video_id or user_id}"), probe_cache.get(video_id),
+            worker_progress(progress), AUDIO_EXT, MP3_BITRATE,
+            on_queued=queue_notifier(message, "🎵 Начинаю загрузку MP3...")
+        )
+    return result["file_name"]
+
+async def fetch_mp3_file(url, message, user_id, state, job):
+    video_id = state.video_id
+    if video_id:
+        # Converted earlier (for anyone, also before a restart): no network at all.
+        # The file belongs to the cache, sessions only point at it.
+        file_name = await lookup_media(video_id, AUDIO_EXT, AUDIO_QUALITY)
+        if file_name is None:
+            async def cache_job():
+                file_name = await convert_mp3(job, url, message, user_id, video_id)
+                if AUDIO_EXT == "mp3":
+                    await run_blocking(prepare_cached_mp3, file_name, video_id)
+                return await run_db(media_cache.put, video_id, AUDIO_EXT, AUDIO_QUALITY, file_name)
+
+            file_name, _ = await flights.run(("mp3-file", video_id), cache_job)
+        else:
+            job.fields["source"] = "media_cache"
+        state.file_name = file_name
+        return file_name
+
+    # No video id to cache by: one shared file, every session holding it keeps
+    # a reference and the file is removed when the last one is released
+    key = ("mp3-file", url)
+    file_name = shared_files.acquire(key)
+    state.file_key = key
+
+    if file_name is None:
+        async def mp3_job():
+            file_name = await convert_mp3(job, url, message, user_id, video_id)
+            shared_files.set_path(key, file_name)
+            return file_name
+
+        try:
+            file_name, _ = await flights.run(key, mp3_job)
+        except Exception:
+            release_mp3_file(state)
+            raise
+
+    state.file_name = file_name
+    return file_name
+
+def release_mp3_file(state):
+    if state.file_key is not None:
+        shared_files.release(state.file_key)
+    state.file_key = None
+    state.file_name = None
+
+async def download_mp3(url, message, user_id, state, fetch=True):
+    with metrics.Job("mp3_fetch", user_id=user_id, video_id=state.video_id) as job:
+        try:
+            # With a cached file_id and default tags nothing has to be downloaded;
+            # the file is fetched later only if the user wants custom tags.
+            video_id = state.video_id
+            cached_file_id = await lookup_file_id(video_id, AUDIO_FORMAT)
+            cached_path = await lookup_media(video_id, AUDIO_EXT, AUDIO_QUALITY)
+            info = probe_cache.get(video_id)
+            stream_fmt = None
+            if STREAM_UPLOADS and info and not cached_path:
+                stream_fmt = streaming.pick_audio_format(
+                    info, STREAM_MAX_BYTES, formats.AAC_CODECS if AUDIO_PASSTHROUGH else None
+                )
+
+            if cached_file_id:
+                state.cached_file_id = cached_file_id
+                job.fields["source"] = "file_id"
+            if cached_path:
+                # Tags are written to a copy at send time, nothing to download
+                state.file_name = cached_path
+                job.fields.setdefault("source", "media_cache")
+            elif stream_fmt:
+                # Transcoded straight into the upload once the tags are known, then
+                # kept in the media cache for everyone else
+                state.stream_format = stream_fmt
+                job.fields.setdefault("source", "stream")
+            elif not cached_file_id and fetch:
+                # Without fetch (jobs go to workers) send_mp3 downloads it on the worker
+                await fetch_mp3_file(url, message, user_id, state, job)
+
+            keyboard = InlineKeyboardMarkup([[
+                InlineKeyboardButton("Да", callback_data="yes_metadata"),
+                InlineKeyboardButton("Нет", callback_data="no_metadata")
+            ]])
+
+            state.stage = "waiting_for_metadata"
+
+            ready_text = "✅ MP3 загружен!" if state.file_name else "✅ MP3 готов к отправке!"
+            await message.edit_text(
+                f"{ready_text}\n\nХотите изменить метаданные (название/автор)?",
+                reply_markup=keyboard
             )
-            
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            
-            add_download_to_history(user_id, title, url, "video")
+
+            job.finish()
             return True
-            
+
+        except Exception as e:
+            job.finish("error", e)
+            await message.edit_text(f"❌ Ошибка при загрузке MP3: {str(e)}")
+            return False
+
+async def send_mp3(message, status_message, user_id, state, title, artist):
+    caption = "Скачано с помощью @SoundsBot_KB"
+    # Only the file with default tags is shared between users via file_id
+    default_tags = (title, artist) == (state.title, state.uploader)
+    with metrics.Job("mp3_send", user_id=user_id, video_id=state.video_id, default_tags=default_tags) as job:
+        if default_tags and state.cached_file_id:
+            try:
+                with job.stage("upload"):
+                    sent = await message.reply_audio(audio=state.cached_file_id, caption=caption)
+                record_download(user_id, state.title, state.url, "mp3", sent, state.duration)
+                release_mp3_file(state)
+                job.fields["source"] = "file_id"
+                job.finish()
+                return
+            except Exception as e:
+                print(f"Cached file_id failed, downloading again: {e}")
+                await run_db(invalidate_cached_file, state.video_id, AUDIO_FORMAT)
+
+        async def produce_mp3():
+            audio = None
+            file_name = None
+            streamed = None
+            if state.stream_format and not state.file_name and state.video_id:
+                # Another request may have converted it meanwhile
+                state.file_name = await lookup_media(state.video_id, AUDIO_EXT, AUDIO_QUALITY)
+            if state.stream_format and not state.file_name:
+                cover = None
+                if AUDIO_EXT == "mp3":
+                    # The same cover as in cached files, fetched while ffmpeg works
+                    cover = asyncio.ensure_future(run_blocking(tagging.fetch_cover, state.video_id))
+                try:
+                    async with ProgressReporter(status_message, "🎵 Готовлю MP3...") as progress:
+                        if AUDIO_PASSTHROUGH:
+                            # The AAC track goes out as it is, no ffmpeg
+                            result = await run_download(
+                                job, user_id, streaming.stream_file, state.stream_format, STREAM_MAX_BYTES,
+                                worker_progress(progress),
+                                on_queued=queue_notifier(status_message, "🎵 Готовлю MP3...")
+                            )
+                        else:
+                            result = await run_download(
+                                job, user_id, streaming.stream_mp3, state.stream_format, title, artist,
+                                MP3_BITRATE, STREAM_MAX_BYTES, state.duration, worker_progress(progress),
+                                on_queued=queue_notifier(status_message, "🎵 Готовлю MP3...")
+                            )
+                    streamed = result["data"]
+                    if cover is not None:
+                        cover = await cover
+                        with job.stage("tagging"):
+                            streamed = await run_blocking(tagging.tag_data, streamed, title, artist, cover)
+                    audio = named_buffer(streamed, f"{title}.{AUDIO_EXT}")
+                except Exception as e:
+                    print(f"Streaming failed, falling back to disk: {e}")
+                    if isinstance(cover, asyncio.Future):
+                        cover.cancel()
+                    cover = streamed = None
+
+            try:
+                if audio is None:
+                    if not state.file_name or not os.path.exists(state.file_name):
+                        # Not fetched yet, or evicted from the cache meanwhile
+                        await fetch_mp3_file(state.url, status_message, user_id, state, job)
+                    with job.stage("tagging"):
+                        audio = file_name = await run_blocking(private_copy, state.file_name, user_id, title)
+                        await run_blocking(set_mp3_tags, file_name, title, artist)
+
+                async with ProgressReporter(status_message, "✅ Отправляю файл...") as progress:
+                    progress.stage("upload")
+                    with job.stage("upload"):
+                        sent = await message.reply_audio(
+                            audio=audio,
+                            title=title,
+                            performer=artist,
+                            caption=caption,
+                            progress=progress.upload
+                        )
+            finally:
+                if file_name and os.path.exists(file_name):
+                    os.remove(file_name)
+
+            if streamed is not None and state.video_id:
+                try:
+                    cached = await run_blocking(
+                        store_streamed_audio, streamed, state.video_id, state.title, state.uploader, cover
+                    )
+                    await run_db(media_cache.put, state.video_id, AUDIO_EXT, AUDIO_QUALITY, cached)
+                except Exception as e:
+                    print(f"Media cache error: {e}")
+                    metrics.stage_errors.inc(stage="cache", type=type(e).__name__)
+
+            file_id = sent.audio.file_id if sent and sent.audio else None
+            if default_tags and state.video_id and file_id:
+                await run_db(cache_file, state.video_id, AUDIO_FORMAT, file_id, "audio")
+            return file_id, sent
+
+        # Same video with the same tags requested meanwhile: one transcode, one upload
+        try:
+            (file_id, sent), joined = await flights.run(
+                ("mp3-send", state.video_id or state.url, title, artist), produce_mp3
+            )
+            if joined:
+                with job.stage("upload"):
+                    sent = await message.reply_audio(audio=file_id, title=title, performer=artist, caption=caption)
+                job.fields["source"] = "joined"
+            record_download(user_id, state.title, state.url, "mp3", sent, state.duration)
+            job.finish()
+        except Exception as e:
+            job.finish("error", e)
+            raise
+        finally:
+            release_mp3_file(state)
+
+async def start_batch(message, user_id, links):
+    status_message = await message.reply("🔍 Получаю список видео...")
+    try:
+        if len(links) == 1:
+            # Playlist: flat extraction, no request per video
+            with metrics.timed("extract"):
+                entries = await probe_queue.run(user_id, downloader.list_entries, links[0], BATCH_MAX_ITEMS)
+        else:
+            entries = [
+                {"url": link, "id": downloader.video_id_from_url(link), "title": None, "duration": None}
+                for link in links[:BATCH_MAX_ITEMS]
+            ]
     except Exception as e:
-        await progress_msg.edit_text(f"❌ Ошибка при загрузке: {str(e)}")
-        return False
+        await status_message.edit_text(f"❌ Ошибка при получении списка видео: {e}")
+        return
+
+    if not entries:
+        await status_message.edit_text("❌ В плейлисте нет видео.")
+        return
+
+    user_states[user_id] = Session(user_id, stage="batch", entries=entries)
+
+    lines = [f"📦 Видео в пакете: {len(entries)}"]
+    if len(entries) >= BATCH_MAX_ITEMS:
+        lines[0] += f" (больше {BATCH_MAX_ITEMS} за раз нельзя)"
+    total_duration = int(sum(entry["duration"] or 0 for entry in entries))
+    if total_duration:
+        lines.append(f"⏱ Общая длительность: {total_duration // 60} мин.")
+    lines.append("")
+    for number, entry in enumerate(entries[:MEDIA_GROUP_SIZE], start=1):
+        lines.append(f"{number}. {entry['title'] or entry['url']}")
+    if len(entries) > MEDIA_GROUP_SIZE:
+        lines.append(f"…и ещё {len(entries) - MEDIA_GROUP_SIZE}")
+    lines.append("\nВыберите формат для всех видео:")
+    await status_message.edit_text("\n".join(lines), reply_markup=get_batch_keyboard(), disable_web_page_preview=True)
+
+async def fetch_batch_item(job, user_id, index, entry, fmt, budget):
+    # One item of a batch: a file_id from the cache or a downloaded file.
+    # Raises with a user-facing reason when the item is skipped.
+    audio = fmt == "mp3"
+    fmt_key = AUDIO_FORMAT if audio else fmt
+    item = {
+        "url": entry["url"],
+        "video_id": entry["id"],
+        "title": entry["title"] or entry["url"],
+        "duration": int(entry["duration"] or 0),
+        "performer": None,
+        "cached": False,
+        "temp": False,
+    }
+    if item["duration"] > MAX_DURATION:
+        raise RuntimeError(f"длиннее {MAX_DURATION // 60} минут")
+
+    file_id = await lookup_file_id(item["video_id"], fmt_key)
+    if file_id:
+        return {**item, "media": file_id, "cached": True}
+
+    info = await probe_video(item["url"], user_id, BATCH_CONCURRENCY)
+    item.update(
+        video_id=info.get("id"),
+        title=info.get("title") or item["title"],
+        duration=int(info.get("duration") or 0),
+        performer=info.get("uploader"),
+    )
+    if item["duration"] > MAX_DURATION:
+        raise RuntimeError(f"длиннее {MAX_DURATION // 60} минут")
+    if user_id not in ADMIN_IDS:
+        refusal = await quota.check(user_id, item["duration"])
+        if refusal:
+            raise RuntimeError(refusal)
+
+    media_format, quality = (AUDIO_EXT, AUDIO_QUALITY) if audio else ("mp4", fmt)
+    path = await lookup_media(item["video_id"], media_format, quality)
+    if path is None:
+        # Only downloaded bytes count against the batch budget
+        if budget["left"] <= 0:
+            raise RuntimeError("превышен общий размер пакета")
+        prefix = unique_prefix(f"batch{user_id}-{index}")
+        if audio:
+            result = await run_download(
+                job, user_id, downloader.fetch_mp3, item["url"], prefix, info, None, AUDIO_EXT, MP3_BITRATE,
+                limit=BATCH_CONCURRENCY
+            )
+            path = result["file_name"]
+        else:
+            result = await run_download(
+                job, user_id, downloader.fetch_video, item["url"], VIDEO_QUALITIES[fmt], prefix, info,
+                limit=BATCH_CONCURRENCY
+            )
+            path = result["file_path"]
 
-async def download_mp3(url, message, user_id, state):
+        size = result["stats"]["size"]
+        if size > budget["left"]:
+            os.remove(path)
+            raise RuntimeError("превышен общий размер пакета")
+        budget["left"] -= size
+        if audio and AUDIO_EXT == "mp3":
+            await run_blocking(prepare_cached_mp3, path, item["video_id"])
+        path = await run_db(media_cache.put, item["video_id"], media_format, quality, path)
+
+    if audio:
+        item["media"] = await run_blocking(private_copy, path, f"batch{user_id}-{index}", item["title"])
+        item["temp"] = True
+        await run_blocking(set_mp3_tags, item["media"], item["title"], item["performer"])
+    else:
+        item["media"] = path
+    return item
+
+async def send_batch_group(message, user_id, items, fmt, job):
+    audio = fmt == "mp3"
+    caption = "Скачано с помощью @SoundsBot_KB"
     try:
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "postprocessors": [{
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192",
-            }],
-            "outtmpl": f"downloads/{user_id}_%(title)s.%(ext)s",
-        }
-
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            file_name = ydl.prepare_filename(info).replace(".webm", ".mp3").replace(".m4a", ".mp3")
-
-        keyboard = InlineKeyboardMarkup([[
-            InlineKeyboardButton("Да", callback_data="yes_metadata"),
-            InlineKeyboardButton("Нет", callback_data="no_metadata")
-        ]])
-
-        state["file_name"] = file_name
-        state["stage"] = "waiting_for_metadata"
-
-        await message.edit_text(
-            "✅ MP3 загружен!\n\nХотите изменить метаданные (название/автор)?",
-            reply_markup=keyboard
-        )
-        
-        add_download_to_history(user_id, info.get('title'), url, "mp3")
-        return True
+        with job.stage("upload"):
+            if len(items) == 1:
+                item = items[0]
+                if audio:
+                    sent = [await message.reply_audio(
+                        audio=item["media"], title=item["title"], performer=item["performer"],
+                        duration=item["duration"], caption=caption
+                    )]
+                else:
+                    sent = [await message.reply_video(
+                        video=item["media"], duration=item["duration"],
+                        caption=f"🎬 **{item['title']}**\n{caption}", supports_streaming=True
+                    )]
+            elif audio:
+                sent = await message.reply_media_group([
+                    InputMediaAudio(
+                        item["media"], caption=caption, duration=item["duration"],
+                        performer=item["performer"], title=item["title"]
+                    )
+                    for item in items
+                ])
+            else:
+                sent = await message.reply_media_group([
+                    InputMediaVideo(
+                        item["media"], caption=f"🎬 **{item['title']}**\n{caption}",
+                        duration=item["duration"], supports_streaming=True
+                    )
+                    for item in items
+                ])
+    finally:
+        for item in items:
+            if item["temp"] and os.path.exists(item["media"]):
+                os.remove(item["media"])
+
+    for item, sent_message in zip(items, sent):
+        record_download(user_id, item["title"], item["url"], "mp3" if audio else "video", sent_message, item["duration"])
+        media = sent_message.audio or sent_message.video
+        if not item["cached"] and item["video_id"] and media:
+            await run_db(cache_file, item["video_id"], AUDIO_FORMAT if audio else fmt, media.file_id,
+                         "audio" if audio else "video")
+    return len(sent)
+
+async def download_batch(message, user_id, entries, fmt):
+    # Items download in parallel (up to BATCH_CONCURRENCY at a time) and go
+    # out in their original order, MEDIA_GROUP_SIZE per media group, each
+    # group as soon as all of its items are ready
+    with metrics.Job("batch", user_id=user_id, items=len(entries), format=fmt) as job:
+        budget = {"left": BATCH_MAX_BYTES}
+        failures = {}
+        counters = {"done": 0, "sent": 0}
+        error = None
+
+        async def run_item(index, entry, progress):
+            try:
+                return await fetch_batch_item(job, user_id, index, entry, fmt, budget)
+            except Exception as e:
+                failures[index] = str(e)[:150]
+                return None
+            finally:
+                counters["done"] += 1
+                progress.items(counters["done"], len(entries), len(failures))
 
+        header = f"📦 Загружаю пакет: {len(entries)} видео"
+        async with ProgressReporter(message, header) as progress:
+            progress.items(0, len(entries))
+            tasks = [asyncio.ensure_future(run_item(index, entry, progress)) for index, entry in enumerate(entries)]
+            try:
+                for start in range(0, len(tasks), MEDIA_GROUP_SIZE):
+                    items = [item for item in await asyncio.gather(*tasks[start:start + MEDIA_GROUP_SIZE]) if item]
+                    if items:
+                        counters["sent"] += await send_batch_group(message, user_id, items, fmt, job)
+            except Exception as e:
+                error = e
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # Files of items that were downloaded but never sent
+                for item in await asyncio.gather(*tasks, return_exceptions=True):
+                    if isinstance(item, dict) and item["temp"] and os.path.exists(item["media"]):
+                        os.remove(item["media"])
+
+        lines = [f"📦 Отправлено {counters['sent']} из {len(entries)}"]
+        if error is not None:
+            lines.append(f"❌ Ошибка при отправке: {error}")
+        if failures:
+            lines += ["", "Не удалось:"]
+            for index in sorted(failures)[:15]:
+                entry = entries[index]
+                lines.append(f"• {(entry['title'] or entry['url'])[:60]}: {failures[index]}")
+            if len(failures) > 15:
+                lines.append(f"…и ещё {len(failures) - 15}")
+        await message.edit_text("\n".join(lines), disable_web_page_preview=True)
+
+        job.fields.update(sent=counters["sent"], failed=len(failures))
+        job.finish("error" if error is not None else "ok", error)
+
+# Jobs get plain data (it may have gone through the queue as JSON) and the
+# messages they answer to; a worker fetches those by id with its own client
+async def video_job(payload, message):
+    return await download_video(
+        payload["url"], payload["quality"], message, payload["user_id"],
+        payload["title"], payload["video_id"], payload["duration"]
+    )
+
+async def mp3_send_job(payload, message, status_message):
+    state = Session.from_dict(payload["state"])
+    try:
+        await send_mp3(message, status_message, payload["user_id"], state, payload["title"], payload["artist"])
     except Exception as e:
-        await message.edit_text(f"❌ Ошибка при загрузке MP3: {str(e)}")
-        return False
+        await status_message.edit_text(f"❌ Ошибка при отправке: {e}")
+        raise
+
+async def batch_job(payload, message):
+    await download_batch(message, payload["user_id"], payload["entries"], payload["fmt"])
+
+JOBS = {"video": video_job, "mp3_send": mp3_send_job, "batch": batch_job}
+
+def job_handlers(client):
+    # Handlers for jobqueue.consume(): the messages are fetched by id with client
+    async def handle(kind, payload):
+        messages = await client.get_messages(payload["chat_id"], payload["message_ids"])
+        await JOBS[kind](payload, *messages)
+
+    return {kind: (lambda payload, kind=kind: handle(kind, payload)) for kind in JOBS}
+
+async def dispatch(kind, payload, *messages):
+    # The last message is the bot's status message
+    if job_broker is None:
+        return await JOBS[kind](payload, *messages)
+    payload = {**payload, "chat_id": messages[0].chat.id, "message_ids": [m.id for m in messages]}
+    await run_blocking(job_broker.put, kind, payload)
+    await messages[-1].edit_text("⏳ Задача в очереди...")
+    return True
 
 @bot.on_message(filters.command("start"))
 async def start_handler(client, message: Message):
     user_id = message.from_user.id
     username = message.from_user.username
     first_name = message.from_user.first_name
-    add_user(user_id, username, first_name)
+    await run_db(add_user, user_id, username, first_name)
 
     await message.reply(
         f"👋 Привет, {first_name}!\n\n"
@@ -157,34 +879,75 @@ async def start_handler(client, message: Message):
         reply_markup=get_main_keyboard()
     )
 
+@bot.on_message(filters.command("cache_stats") & filters.user(ADMIN_IDS))
+async def cache_stats_handler(client, message: Message):
+    stats = await run_db(get_cache_stats)
+    total = stats["hits"] + stats["misses"]
+    ratio = stats["hits"] / total * 100 if total else 0
+    await message.reply(
+        "📦 **Кэш файлов**\n\n"
+        f"Записей: {stats['entries']}\n"
+        f"Попаданий: {stats['hits']}\n"
+        f"Промахов: {stats['misses']}\n"
+        f"Доля попаданий: {ratio:.1f}%"
+    )
+
+@bot.on_message(filters.command("cache_invalidate") & filters.user(ADMIN_IDS))
+async def cache_invalidate_handler(client, message: Message):
+    if len(message.command) < 2:
+        await message.reply("Использование: /cache_invalidate <ссылка или ID видео> [формат]")
+        return
+
+    target = message.command[1]
+    video_id = downloader.video_id_from_url(target) or target
+    fmt = message.command[2] if len(message.command) > 2 else None
+    removed = await run_db(invalidate_cached_file, video_id, fmt)
+    await message.reply(f"🗑 Удалено записей: {removed}")
+
 @bot.on_message(filters.regex(r"https?://(www\.)?(youtube\.com|youtu\.be)/.+"))
 async def url_handler(client, message: Message):
     url = message.text
     user_id = message.from_user.id
     
     try:
+        refusal = await check_limits(message, user_id)
+        if refusal:
+            await message.reply(refusal)
+            return
+
+        links = YOUTUBE_LINK_RE.findall(url)
+        if len(links) > 1 or downloader.is_playlist_url(url):
+            await start_batch(message, user_id, links)
+            return
+
         status_message = await message.reply("🔍 Получаю информацию о видео...")
         
-        with YoutubeDL({"quiet": True, "noplaylist": True}) as ydl:
-            info = ydl.extract_info(url, download=False)
-            duration = info.get("duration", 0)
-            title = info.get("title", "Unknown video")
-            uploader = info.get("uploader", "Unknown uploader")
+        with metrics.timed("extract"):
+            info = await probe_video(url, user_id)
+        duration = info.get("duration", 0)
+        title = info.get("title", "Unknown video")
+        uploader = info.get("uploader", "Unknown uploader")
 
-        if duration > 1200:  # 20 minutes
+        if duration > MAX_DURATION:
             await status_message.edit_text(
                 f"❌ Видео **{title}** слишком длинное ({duration // 60} минут). "
                 "Максимальная длина — 20 минут."
             )
             return
 
-        user_states[user_id] = {
-            "url": url,
-            "title": title,
-            "uploader": uploader,
-            "duration": duration,
-            "status_message": status_message
-        }
+        refusal = await check_limits(message, user_id, duration, rate=False)
+        if refusal:
+            await status_message.edit_text(refusal)
+            return
+
+        user_states[user_id] = Session(
+            user_id,
+            url=url,
+            video_id=info.get("id"),
+            title=title,
+            uploader=uploader,
+            duration=duration
+        )
 
         await status_message.edit_text(
             f"🎥 **{title}**\n"
@@ -208,6 +971,11 @@ async def audio_handler(client, message: Message):
     if not (is_audio or is_mp3_document):
         await message.reply("❌ Пожалуйста, отправьте MP3 файл.")
         return
+
+    refusal = await check_limits(message, user_id)
+    if refusal:
+        await message.reply(refusal)
+        return
     
     # Get the file
     file_obj = message.audio if is_audio else message.document
@@ -223,11 +991,12 @@ async def audio_handler(client, message: Message):
     await message.download(file_path)
     
     # Store file info in user state
-    user_states[user_id] = {
-        "file_path": file_path,
-        "original_name": file_obj.file_name,
-        "stage": "start_editing"
-    }
+    user_states[user_id] = Session(
+        user_id,
+        file_path=file_path,
+        original_name=file_obj.file_name,
+        stage="start_editing"
+    )
     
     # Create keyboard
     keyboard = InlineKeyboardMarkup([
@@ -279,8 +1048,14 @@ async def mp3_handler(client, callback_query: CallbackQuery):
         await callback_query.answer("❌ Сессия истекла. Отправьте ссылку заново.")
         return
 
+    # Other sessions may have used up the quota since the link was sent
+    refusal = await check_limits(callback_query.message, user_id, state.duration, rate=False)
+    if refusal:
+        await callback_query.answer(refusal, show_alert=True)
+        return
+
     await callback_query.message.edit_text("🎵 Начинаю загрузку MP3...")
-    await download_mp3(state["url"], callback_query.message, user_id, state)
+    await download_mp3(state.url, callback_query.message, user_id, state, fetch=job_broker is None)
 
 @bot.on_callback_query(filters.regex("choose_video"))
 async def video_quality_handler(client, callback_query: CallbackQuery):
@@ -299,31 +1074,68 @@ async def download_video_handler(client, callback_query: CallbackQuery):
         await callback_query.answer("❌ Сессия истекла. Отправьте ссылку заново.")
         return
 
-    success = await download_video(
-        state["url"], 
-        quality, 
-        callback_query.message,
-        user_id
-    )
+    refusal = await check_limits(callback_query.message, user_id, state.duration, rate=False)
+    if refusal:
+        await callback_query.answer(refusal, show_alert=True)
+        return
+
+    success = await dispatch("video", {
+        "url": state.url,
+        "quality": quality,
+        "user_id": user_id,
+        "title": state.title,
+        "video_id": state.video_id,
+        "duration": state.duration,
+    }, callback_query.message)
 
     if success:
-        del user_states[user_id]
+        user_states.pop(user_id)
+
+@bot.on_callback_query(filters.regex("^batch_"))
+async def batch_handler(client, callback_query: CallbackQuery):
+    user_id = callback_query.from_user.id
+    state = user_states.get(user_id)
+    fmt = callback_query.data.split("_", 1)[1]
+
+    if not state or not state.entries:
+        await callback_query.answer("❌ Сессия истекла. Отправьте ссылки заново.")
+        return
+    if fmt != "mp3" and fmt not in VIDEO_QUALITIES:
+        await callback_query.answer("❌ Неизвестный формат.")
+        return
+
+    # Minutes are checked per item, here only whether anything is left today
+    refusal = await check_limits(callback_query.message, user_id, rate=False)
+    if refusal:
+        await callback_query.answer(refusal, show_alert=True)
+        return
+
+    user_states.pop(user_id)
+    await dispatch("batch", {"user_id": user_id, "entries": state.entries, "fmt": fmt}, callback_query.message)
 
 @bot.on_callback_query(filters.regex("edit_metadata"))
 async def edit_metadata_handler(client, callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
     
-    if user_id not in user_states:
+    state = user_states.get(user_id)
+    
+    if not state:
         await callback_query.answer("❌ Сессия истекла. Отправьте файл заново.")
         return
     
-    user_states[user_id]["stage"] = "waiting_for_title"
+    state.stage = "waiting_for_title"
     await callback_query.message.edit_text("📝 Введите новое название трека:")
 
 @bot.on_callback_query(filters.regex("yes_metadata"))
 async def yes_metadata_handler(client, callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
-    user_states[user_id]["stage"] = "waiting_for_new_title"
+    state = user_states.get(user_id)
+
+    if not state:
+        await callback_query.answer("❌ Сессия истекла. Отправьте ссылку заново.")
+        return
+
+    state.stage = "waiting_for_new_title"
     
     await callback_query.message.edit_text(
         "📝 Введите новое название песни:"
@@ -332,21 +1144,18 @@ async def yes_metadata_handler(client, callback_query: CallbackQuery):
 @bot.on_callback_query(filters.regex("no_metadata"))
 async def no_metadata_handler(client, callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
-    state = user_states[user_id]
+    state = user_states.get(user_id)
+
+    if not state:
+        await callback_query.answer("❌ Сессия истекла. Отправьте ссылку заново.")
+        return
     
-    set_mp3_tags(state["file_name"], state["title"], state["uploader"])
     await callback_query.message.edit_text("✅ Отправляю файл...")
 
-    await callback_query.message.reply_audio(
-        audio=state["file_name"],
-        title=state["title"],
-        performer=state["uploader"],
-        caption="Скачано с помощью @SoundsBot_KB"
-    )
-
-    if os.path.exists(state["file_name"]):
-        os.remove(state["file_name"])
-    del user_states[user_id]
+    user_states.pop(user_id)
+    await dispatch("mp3_send", {
+        "user_id": user_id, "state": state.to_dict(), "title": state.title, "artist": state.uploader,
+    }, callback_query.message, callback_query.message)
 
 @bot.on_callback_query(filters.regex("back_to_format"))
 async def back_to_format_handler(client, callback_query: CallbackQuery):
@@ -359,30 +1168,48 @@ async def back_to_format_handler(client, callback_query: CallbackQuery):
 async def metadata_handler(client, message: Message):
     user_id = message.from_user.id
     
-    if user_id not in user_states:
-        return
+    state = user_states.get(user_id)
 
-    state = user_states[user_id]
+    if not state:
+        return
 
-    if state["stage"] == "waiting_for_new_title":
-        state["new_title"] = message.text
+    if state.stage == "waiting_for_new_title":
+        state.new_title = message.text
         await message.reply("👤 Теперь введите имя исполнителя:")
-        state["stage"] = "waiting_for_new_artist"
+        state.stage = "waiting_for_new_artist"
 
-    elif state["stage"] == "waiting_for_new_artist":
-        state["new_artist"] = message.text
-        set_mp3_tags(state["file_name"], state["new_title"], state["new_artist"])
+    elif state.stage == "waiting_for_new_artist":
+        state.new_artist = message.text
+        status_message = await message.reply("✅ Отправляю файл...")
 
-        await message.reply_audio(
-            audio=state["file_name"],
-            title=state["new_title"],
-            performer=state["new_artist"],
-            caption="Скачано с помощью @SoundsBot_KB"
-        )
+        user_states.pop(user_id)
+        await dispatch("mp3_send", {
+            "user_id": user_id, "state": state.to_dict(), "title": state.new_title, "artist": state.new_artist,
+        }, message, status_message)
 
-        if os.path.exists(state["file_name"]):
-            os.remove(state["file_name"])
-        del user_states[user_id]
+async def main():
+    # Connect first: the schema check, the cache sync and the yt-dlp import
+    # overlap with the handshake. run_db() has a single thread, so every
+    # query a handler makes waits for init_db.
+    db_ready = asyncio.ensure_future(run_db(init_db))
+    if SESSION_PERSIST:
+        # Restored sessions have to be there before the first callback
+        await db_ready
+        user_states.load(on_load=restore_session)
+    await bot.start()
+    await db_ready
+    user_states.start()
+    asyncio.ensure_future(run_db(media_cache.sync))
+    asyncio.get_running_loop().run_in_executor(None, downloader.warm_up)
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT, METRICS_HOST)
+    if isinstance(job_broker, jobqueue.LocalBroker):
+        # "memory": the queue lives in this process, so nobody else can consume it
+        asyncio.ensure_future(jobqueue.consume(job_broker, job_handlers(bot), "front", WORKER_JOBS, lease=JOB_LEASE))
+    await idle()
+    await bot.stop()
 
-# Запуск бота
-bot.run()
\ No newline at end of file
+# Запуск бота (worker.py импортирует этот модуль, но бота не запускает)
+if __name__ == "__main__":
+    bot.run(main())
+    user_states.save()
\ No newline at end of file
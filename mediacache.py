@@ -0,0 +1,134 @@
+# mediacache.py
+# Готовые MP3/MP4 на диске (downloads/cache) по ключу (id видео, формат,
+# качество). Индекс — размер и время последнего использования — хранится в
+# users.db, поэтому после перезапуска повторный запрос обходится без сети.
+# Общий объём ограничен: при превышении удаляются давно не использованные
+# файлы. Файлы кэша не меняются; теги пишутся в копию (clone()).
+# Методы блокирующие — из асинхронного кода их вызывают через run_db().
+# Кэшем могут пользоваться несколько процессов (worker.py): общий объём
+# берётся из индекса, а не считается в памяти.
+import os
+import shutil
+import threading
+import time
+from database import (
+    get_media_entry, touch_media_entry, put_media_entry, delete_media_entry, get_media_entries,
+    get_media_total,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl FICLONE из linux/fs.h: reflink-копия на btrfs/xfs
+FICLONE = 0x40049409
+
+# Файл без записи в индексе моложе этого может как раз добавляться другим
+# процессом (os.replace уже сделан, запись ещё нет) — sync() его не трогает
+SYNC_GRACE = 60
+
+
+def clone(src, dst):
+    # Копия, которая делит блоки с исходником, пока одну из них не изменят;
+    # где reflink не поддерживается — обычное копирование
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as source, open(dst, "wb") as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            return dst
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    return dst
+
+
+class MediaCache:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.total = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(video_id, fmt, quality):
+        # quality — битрейт для аудио, качество (720p, ...) для видео
+        return f"{video_id}-{fmt}-{quality}"
+
+    def get(self, video_id, fmt, quality):
+        # Путь к файлу или None
+        key = self.key(video_id, fmt, quality)
+        with self._lock:
+            row = get_media_entry(key)
+            if row is None:
+                return None
+            path = row[0]
+            if not os.path.exists(path):
+                delete_media_entry(key)
+                self.total = get_media_total()
+                return None
+            touch_media_entry(key, time.time())
+        return path
+
+    def put(self, video_id, fmt, quality, src):
+        # Переносит готовый файл в кэш и возвращает его новый путь
+        key = self.key(video_id, fmt, quality)
+        path = os.path.join(self.root, key + os.path.splitext(src)[1])
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            # Атомарно: файл по этому пути либо старый, либо новый целиком
+            os.replace(src, path)
+        except OSError:
+            # downloads/ и кэш на разных файловых системах
+            tmp_path = path + ".tmp"
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, path)
+            os.remove(src)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            old = get_media_entry(key)
+            if old is not None and old[0] != path and os.path.exists(old[0]):
+                os.remove(old[0])
+            put_media_entry(key, video_id, fmt, quality, path, size, time.time())
+            self.total = get_media_total()
+            self._evict(keep=key)
+        return path
+
+    def _evict(self, keep=None):
+        # Только что добавленный файл не трогаем, даже если он один больше лимита
+        if self.total <= self.max_bytes:
+            return
+        for key, path, size in get_media_entries():
+            if self.total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            if os.path.exists(path):
+                os.remove(path)
+            delete_media_entry(key)
+            self.total -= size
+
+    def sync(self):
+        # После сбоя индекс и каталог могут расходиться: записи без файлов
+        # и файлы без записей (в том числе недописанные .tmp) удаляются
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            known = set()
+            self.total = 0
+            for key, path, size in get_media_entries():
+                if os.path.exists(path):
+                    known.add(os.path.abspath(path))
+                    self.total += size
+                else:
+                    delete_media_entry(key)
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if not os.path.isfile(path) or os.path.abspath(path) in known:
+                    continue
+                # ctime меняется и при os.replace, mtime yt-dlp ставит по дате видео
+                stat = os.stat(path)
+                if time.time() - max(stat.st_mtime, stat.st_ctime) > SYNC_GRACE:
+                    os.remove(path)
+            self._evict()
+        return self.total
@@ -0,0 +1,276 @@
+# metrics.py
+# Метрики в формате Prometheus (отдаются по HTTP на /metrics) и одна
+# JSON-строка в лог на каждую задачу. Без внешних зависимостей: счётчики
+# обновляются из event loop и из потоков пула, поэтому всё под одной блокировкой.
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_lock = threading.Lock()
+_registry = []
+
+# Границы по умолчанию: от быстрых запросов к БД до многоминутных загрузок
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with _lock:
+            return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"
+                for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), fn=None):
+        # fn — значение считается при каждом запросе /metrics: число или
+        # словарь {кортеж значений меток: число}
+        super().__init__(name, documentation, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def collect(self):
+        values = self._values
+        if self.fn is not None:
+            try:
+                values = self.fn()
+            except Exception as e:
+                print(f"Metric {self.name} error: {e}")
+                return []
+            if not isinstance(values, dict):
+                return [f"{self.name} {values}"]
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"
+                for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                # [накопительные счётчики бакетов, сумма, число наблюдений]
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.label_names, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.label_names, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+def render():
+    lines = []
+    with _lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        if isinstance(metric, Gauge) and metric.fn is not None:
+            # fn может сам брать блокировки (БД, очереди)
+            samples = metric.collect()
+        else:
+            with _lock:
+                samples = metric.collect()
+        lines.extend(metric.header())
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+# --- метрики бота ---
+
+stage_seconds = Histogram("bot_stage_seconds", "Duration of pipeline stages", ["stage"])
+stage_errors = Counter("bot_errors_total", "Failed stages by exception type", ["stage", "type"])
+jobs_total = Counter("bot_jobs_total", "Finished jobs", ["kind", "status"])
+bytes_total = Counter("bot_bytes_total", "Bytes downloaded or produced", ["kind", "mode"])
+cache_requests = Counter("bot_cache_requests_total", "Cache lookups", ["cache", "result"])
+media_paths = Counter(
+    "bot_media_path_total", "How files were produced: copy, remux, transcode (see formats.py)", ["kind", "path"]
+)
+_active = 0
+active_jobs = Gauge("bot_active_jobs", "Jobs being processed right now", fn=lambda: _active)
+
+
+def cache_lookup(cache, hit):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def _cache_hit_ratios():
+    with _lock:
+        totals = {}
+        for (cache, result), count in cache_requests._values.items():
+            hits, total = totals.get(cache, (0, 0))
+            totals[cache] = (hits + (count if result == "hit" else 0), total + count)
+    return {(cache,): round(hits / total, 4) for cache, (hits, total) in totals.items() if total}
+
+
+cache_hit_ratio = Gauge("bot_cache_hit_ratio", "Share of cache lookups that hit", ["cache"], fn=_cache_hit_ratios)
+
+
+@contextmanager
+def timed(stage):
+    # Время этапа в bot_stage_seconds; упавший этап — в bot_errors_total
+    started = time.monotonic()
+    try:
+        yield
+    except BaseException as e:
+        stage_errors.inc(stage=stage, type=type(e).__name__)
+        raise
+    finally:
+        stage_seconds.observe(time.monotonic() - started, stage=stage)
+
+
+class Job:
+    # Одна задача (видео или MP3): этапы, байты и итог; при завершении
+    # пишет строку JSON в лог
+    def __init__(self, kind, **fields):
+        global _active
+        self.kind = kind
+        self.fields = fields
+        self.stages = {}
+        self.started = time.monotonic()
+        self.finished = False
+        with _lock:
+            _active += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.finish("error", exc)
+        else:
+            self.finish()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            with timed(name):
+                yield
+        finally:
+            self.stages[name] = round(self.stages.get(name, 0) + time.monotonic() - started, 3)
+
+    def record(self, name, seconds):
+        # Этап, замеренный внутри задачи пула (например, ffmpeg внутри yt-dlp)
+        stage_seconds.observe(seconds, stage=name)
+        self.stages[name] = round(self.stages.get(name, 0) + seconds, 3)
+
+    def transfer(self, stats, elapsed=None):
+        # stats — из downloader/streaming; elapsed — сколько задача заняла
+        # вместе с ожиданием в очереди
+        bytes_total.inc(stats.get("size", 0), kind=self.kind, mode=stats.get("mode", ""))
+        self.fields.update(mode=stats.get("mode"), size=stats.get("size"),
+                           peak_disk=stats.get("peak_disk"), ttfb=round(stats.get("ttfb", 0), 3))
+        if stats.get("path"):
+            media_paths.inc(kind=self.kind, path=stats["path"])
+            self.fields["path"] = stats["path"]
+        if stats.get("format"):
+            self.fields["format"] = stats["format"]
+        for name, seconds in (stats.get("timings") or {}).items():
+            self.record(name, seconds)
+        if elapsed is not None:
+            self.record("queue", max(0.0, elapsed - stats.get("upload_start", 0)))
+
+    def finish(self, status="ok", error=None):
+        global _active
+        if self.finished:
+            return
+        self.finished = True
+        with _lock:
+            _active -= 1
+        jobs_total.inc(kind=self.kind, status=status)
+        line = {
+            "event": "job",
+            "kind": self.kind,
+            "status": status,
+            "seconds": round(time.monotonic() - self.started, 3),
+            "stages": self.stages,
+            **self.fields,
+        }
+        if error is not None:
+            line["error"] = type(error).__name__
+        print(json.dumps(line, ensure_ascii=False, default=str))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,176 @@
+# progress.py
+# Прогресс загрузки/конвертации/отправки в статусном сообщении. Хуки yt-dlp,
+# ffmpeg и pyrogram только запоминают последнее состояние (их можно вызывать
+# из потоков пула), а сообщение редактирует одна задача в event loop — не
+# чаще PROGRESS_EDIT_INTERVAL на чат, сколько бы событий ни пришло.
+import asyncio
+import time
+from pyrogram.errors import FloodWait, MessageNotModified
+from config import PROGRESS_EDIT_INTERVAL
+
+# chat_id -> время последнего (или уже назначенного) редактирования, общее
+# для всех задач чата
+_last_edit = {}
+
+STAGES = {
+    "download": "⬇️ Загрузка",
+    "convert": "🎛 Конвертация",
+    "upload": "📤 Отправка",
+    "batch": "📦 Готово",
+}
+
+
+def _remember_edit(chat_id, at=None):
+    now = time.monotonic()
+    # Более позднее время, уже занятое другой задачей чата, не затираем
+    _last_edit[chat_id] = max(_last_edit.get(chat_id, 0), now if at is None else at)
+    if len(_last_edit) > 10000:
+        # Старые записи уже ничего не ограничивают
+        for key, edited_at in list(_last_edit.items()):
+            if now - edited_at > PROGRESS_EDIT_INTERVAL:
+                del _last_edit[key]
+
+
+def _format_bytes(value):
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if value < 1024 or unit == "ГБ":
+            return f"{value:.1f} {unit}" if unit != "Б" else f"{int(value)} {unit}"
+        value /= 1024
+
+
+def _format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def _bar(percent, width=10):
+    filled = int(percent / 100 * width)
+    return "▰" * filled + "▱" * (width - filled)
+
+
+class ProgressReporter:
+    def __init__(self, message, header, interval=PROGRESS_EDIT_INTERVAL):
+        self.message = message
+        self.header = header
+        self.interval = interval
+        self._chat_id = message.chat.id if message.chat else None
+        self._state = None
+        self._rendered = None
+        self._loop = None
+        self._changed = None
+        self._wake_pending = False
+        self._task = None
+        self.failed = 0
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def _update(self, stage, done=None, total=None, speed=None, eta=None):
+        # Может вызываться из любого потока
+        self._state = (stage, done, total, speed, eta)
+        if self._loop is not None and not self._wake_pending:
+            self._wake_pending = True
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        self._wake_pending = False
+        self._changed.set()
+
+    # --- источники событий ---
+
+    def stage(self, stage):
+        self._update(stage)
+
+    def download(self, done, total=None, speed=None, eta=None, started=None):
+        if speed is None and started is not None:
+            elapsed = time.monotonic() - started
+            speed = done / elapsed if elapsed > 0 else None
+        if eta is None and speed and total:
+            eta = (total - done) / speed
+        self._update("download", done, total, speed, eta)
+
+    def transcode(self, done_seconds, total_seconds):
+        self._update("convert", done_seconds, total_seconds)
+
+    def ytdl_hook(self, d):
+        # progress_hooks yt-dlp
+        if d["status"] == "downloading":
+            total = d.get("total_bytes") or d.get("total_bytes_estimate")
+            self.download(d.get("downloaded_bytes") or 0, total, d.get("speed"), d.get("eta"))
+
+    def postprocessor_hook(self, d):
+        # postprocessor_hooks yt-dlp: ffmpeg сообщает только начало и конец
+        if d["status"] == "started" and d.get("postprocessor") != "MoveFiles":
+            self.stage("convert")
+
+    def items(self, done, total, failed=0):
+        # Пакетная загрузка: сколько элементов обработано (и сколько из них с ошибкой)
+        self.failed = failed
+        self._update("batch", done, total)
+
+    async def upload(self, current, total):
+        # progress= для reply_video/reply_audio
+        self._update("upload", current, total)
+
+    # --- вывод ---
+
+    def render(self):
+        if self._state is None:
+            return self.header
+        stage, done, total, speed, eta = self._state
+        lines = [self.header, "", STAGES.get(stage, stage)]
+        if done is not None and total:
+            percent = min(100.0, done / total * 100)
+            lines[-1] += f": {_bar(percent)} {percent:.0f}%"
+        details = []
+        if stage == "batch":
+            details.append(f"{done} из {total}")
+            if self.failed:
+                details.append(f"❌ {self.failed}")
+        if stage in ("download", "upload") and done is not None:
+            details.append(_format_bytes(done) + (f" из {_format_bytes(total)}" if total else ""))
+        if speed:
+            details.append(f"⚡ {_format_bytes(speed)}/с")
+        if eta:
+            details.append(f"⏳ {_format_eta(eta)}")
+        if details:
+            lines.append(" • ".join(details))
+        return "\n".join(lines)
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+
+            # Все события за время ожидания схлопываются в одно редактирование.
+            # Слот занимаем до сна: другие задачи этого чата встанут после него.
+            now = time.monotonic()
+            slot = max(now, _last_edit.get(self._chat_id, 0) + self.interval)
+            _remember_edit(self._chat_id, slot)
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+            text = self.render()
+            if text == self._rendered:
+                continue
+            try:
+                await self.message.edit_text(text)
+                self._rendered = text
+            except FloodWait as e:
+                await asyncio.sleep(e.value)
+                self._changed.set()
+            except MessageNotModified:
+                pass
+            except Exception as e:
+                print(f"Progress edit error: {e}")
+            _remember_edit(self._chat_id)
@@ -0,0 +1,91 @@
+# ratelimit.py
+# Защита от пользователя, который шлёт ссылки в цикле: token bucket на
+# пользователя и на чат плюс суточная квота по байтам и минутам. Проверки
+# идут до любой работы yt-dlp и почти всегда обходятся без БД: счётчики
+# живут в памяти, из download_history они только подгружаются один раз в
+# сутки для каждого пользователя.
+import time
+from collections import OrderedDict
+from datetime import date
+from database import run_db, get_usage_since
+
+
+class RateLimiter:
+    # rate — сколько запросов в минуту восполняется, burst — сколько можно подряд
+    def __init__(self, rate, burst, maxsize=10000):
+        self.rate = rate / 60 if rate else None
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> [токены, время обновления]
+
+    def acquire(self, key, cost=1):
+        # 0 — можно; иначе через сколько секунд появится токен
+        if self.rate is None:
+            return 0
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            # Вытесненное ведро просто начнётся заново полным
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0
+        return (cost - bucket[0]) / self.rate
+
+
+class DailyQuota:
+    # ttl — через сколько секунд перечитывать счётчики из БД; нужно, когда
+    # скачивания записывают другие процессы (worker.py). None — раз в сутки.
+    def __init__(self, max_bytes=None, max_minutes=None, ttl=None):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_minutes * 60 if max_minutes else None
+        self.ttl = ttl
+        self._day = None
+        self._usage = {}  # user_id -> [байт, секунд, когда прочитано из БД] за сегодня
+
+    @property
+    def enabled(self):
+        return bool(self.max_bytes or self.max_seconds)
+
+    def _today(self):
+        today = date.today().isoformat()
+        if today != self._day:
+            self._day = today
+            self._usage.clear()
+        return today
+
+    async def usage(self, user_id):
+        today = self._today()
+        usage = self._usage.get(user_id)
+        if usage is None or (self.ttl and time.monotonic() - usage[2] > self.ttl):
+            used_bytes, used_seconds = await run_db(get_usage_since, user_id, today + " 00:00:00")
+            usage = self._usage[user_id] = [used_bytes, used_seconds, time.monotonic()]
+        return usage
+
+    async def check(self, user_id, duration=0):
+        # Текст отказа или None; duration — длительность того, что собираются скачать
+        if not self.enabled:
+            return None
+        used_bytes, used_seconds, _ = await self.usage(user_id)
+        if self.max_bytes and used_bytes >= self.max_bytes:
+            return f"📦 Суточный лимит {self.max_bytes // (1024 * 1024)} МБ исчерпан."
+        if self.max_seconds and used_seconds + (duration or 0) > self.max_seconds:
+            left = max(0, self.max_seconds - used_seconds) // 60
+            return (f"⏱ Суточный лимит {self.max_seconds // 60} минут: "
+                    f"осталось {left} мин.")
+        return None
+
+    def add(self, user_id, size=None, duration=None):
+        # Вызывается вместе с add_download_to_history. Если пользователя ещё
+        # нет в памяти, его строка попадёт в подсчёт при загрузке из БД.
+        self._today()
+        usage = self._usage.get(user_id)
+        if usage is not None:
+            usage[0] += size or 0
+            usage[1] += duration or 0
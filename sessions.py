@@ -0,0 +1,160 @@
+# sessions.py
+# Состояния пользователей между сообщениями. Хранилище ограничено по размеру
+# (вытесняется самая давняя сессия) и по времени жизни; при вытеснении или
+# истечении вызывается on_expire, чтобы удалить временные файлы сессии.
+# При persist=True живые сессии сохраняются в users.db и переживают перезапуск.
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from database import run_db, save_sessions, load_sessions
+
+
+class Session:
+    __slots__ = (
+        "user_id",
+        "stage",
+        # YouTube
+        "url", "video_id", "title", "uploader", "duration",
+        "cached_file_id", "stream_format",
+        # Пакет: [{"url", "id", "title", "duration"}, ...]
+        "entries",
+        # MP3 на диске (общий файл из singleflight.SharedFiles)
+        "file_name", "file_key",
+        # MP3, присланный пользователем
+        "file_path", "original_name",
+        # Новые метаданные
+        "new_title", "new_artist",
+        "expires_at",
+    )
+
+    def __init__(self, user_id, **fields):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.user_id = user_id
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+        if isinstance(data.get("file_key"), tuple):
+            data["file_key"] = list(data["file_key"])
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        if isinstance(data.get("file_key"), list):
+            data["file_key"] = tuple(data["file_key"])
+        return cls(data.pop("user_id"), **data)
+
+
+class SessionStore:
+    def __init__(self, maxsize=10000, ttl=1800, on_expire=None, persist=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.persist = persist
+        self._sessions = OrderedDict()
+        self._sweeper = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id):
+        session = self.get(user_id)
+        if session is None:
+            raise KeyError(user_id)
+        return session
+
+    def __setitem__(self, user_id, session):
+        old = self._sessions.pop(user_id, None)
+        if old is not None and old is not session:
+            self._expire(old)
+        session.expires_at = time.time() + self.ttl
+        self._sessions[user_id] = session
+        while len(self._sessions) > self.maxsize:
+            _, evicted = self._sessions.popitem(last=False)
+            self._expire(evicted)
+
+    def __delitem__(self, user_id):
+        # Обычное завершение сценария: файлы уже убраны хендлером
+        del self._sessions[user_id]
+
+    def get(self, user_id, default=None):
+        session = self._sessions.get(user_id)
+        if session is None:
+            return default
+        now = time.time()
+        if session.expires_at <= now:
+            del self._sessions[user_id]
+            self._expire(session)
+            return default
+        session.expires_at = now + self.ttl
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def pop(self, user_id, default=None):
+        return self._sessions.pop(user_id, default)
+
+    def _expire(self, session):
+        if self.on_expire is not None:
+            try:
+                self.on_expire(session)
+            except Exception as e:
+                print(f"Session cleanup error: {e}")
+
+    def sweep(self):
+        # Самые давние сессии в начале, поэтому можно остановиться на первой живой
+        now = time.time()
+        expired = 0
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.expires_at > now:
+                break
+            del self._sessions[user_id]
+            self._expire(session)
+            expired += 1
+        return expired
+
+    async def _sweep_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+            if self.persist:
+                await run_db(save_sessions, self.dump())
+
+    def start(self, interval=60):
+        if self._sweeper is None:
+            self._sweeper = asyncio.ensure_future(self._sweep_loop(interval))
+
+    def dump(self):
+        return [(session.user_id, json.dumps(session.to_dict()), session.expires_at)
+                for session in self._sessions.values()]
+
+    def save(self):
+        if self.persist:
+            save_sessions(self.dump())
+
+    def load(self, on_load=None):
+        # on_load вызывается для каждой сохранённой сессии (в том числе уже
+        # истёкшей), чтобы восстановить связанные ресурсы — ссылки на общие
+        # файлы; истёкшие сразу же проходят через on_expire
+        if not self.persist:
+            return 0
+        now = time.time()
+        for data, expires_at in load_sessions():
+            session = Session.from_dict(json.loads(data))
+            if on_load is not None:
+                on_load(session)
+            if expires_at <= now:
+                self._expire(session)
+                continue
+            self._sessions[session.user_id] = session
+        while len(self._sessions) > self.maxsize:
+            _, evicted = self._sessions.popitem(last=False)
+            self._expire(evicted)
+        return len(self._sessions)
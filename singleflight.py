@@ -0,0 +1,58 @@
+# singleflight.py
+# Объединение одинаковых задач: пока задача с ключом выполняется, новые
+# запросы с тем же ключом ждут её результат, а не запускают свою копию.
+import asyncio
+import os
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+
+    def __contains__(self, key):
+        return key in self._flights
+
+    async def run(self, key, fn, *args, **kwargs):
+        # Возвращает (результат, joined); joined=True, если результат
+        # получен от чужой задачи, уже выполнявшейся с этим ключом
+        future = self._flights.get(key)
+        joined = future is not None
+        if not joined:
+            future = asyncio.ensure_future(fn(*args, **kwargs))
+            self._flights[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # shield: отмена одного ожидающего не отменяет общую задачу
+        return await asyncio.shield(future), joined
+
+    def _forget(self, key, future):
+        if self._flights.get(key) is future:
+            del self._flights[key]
+
+
+class SharedFiles:
+    # Файл, которым пользуются несколько задач, удаляется, когда его
+    # отпустит последняя. Ссылку берут до начала загрузки (путь ещё
+    # неизвестен), путь регистрирует та задача, которая файл создала.
+    def __init__(self):
+        self._refs = {}
+        self._paths = {}
+
+    def acquire(self, key):
+        self._refs[key] = self._refs.get(key, 0) + 1
+        return self._paths.get(key)
+
+    def set_path(self, key, path):
+        self._paths[key] = path
+
+    def refs(self, key):
+        return self._refs.get(key, 0)
+
+    def release(self, key):
+        count = self._refs.get(key, 0) - 1
+        if count > 0:
+            self._refs[key] = count
+            return
+        self._refs.pop(key, None)
+        path = self._paths.pop(key, None)
+        if path and os.path.exists(path):
+            os.remove(path)
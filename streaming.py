@@ -0,0 +1,211 @@
+# streaming.py
+# Потоковая загрузка без файлов на диске: исходный поток качается кусками
+# (Range-запросами, как это делает yt-dlp для YouTube) и либо сразу
+# накапливается в памяти (готовый MP4), либо через pipe идёт в ffmpeg,
+# который отдаёт MP3 в stdout. pyrogram нужен размер файла до начала
+# отправки, поэтому результат собирается целиком, но диск не используется.
+import subprocess
+import threading
+import time
+import urllib.request
+
+HTTP_CHUNK_SIZE = 10 * 1024 * 1024
+READ_SIZE = 64 * 1024
+DIRECT_PROTOCOLS = ("https", "http")
+# Ключи, которые ffmpeg пишет в -progress (всё остальное в stderr — ошибки)
+PROGRESS_KEYS = {
+    "frame", "fps", "bitrate", "total_size", "out_time_us",
+    "out_time_ms", "out_time", "dup_frames", "drop_frames", "speed", "progress",
+}
+
+
+def _format_size(fmt):
+    return fmt.get("filesize") or fmt.get("filesize_approx") or 0
+
+
+def _is_direct(fmt):
+    return fmt.get("url") and fmt.get("protocol", "https") in DIRECT_PROTOCOLS
+
+
+def pick_audio_format(info, max_bytes, codecs=None):
+    # Лучшая аудиодорожка без видео, которую можно скачать одним HTTP-потоком;
+    # codecs — префиксы acodec, например ("mp4a",) для отправки без ffmpeg
+    candidates = [
+        fmt for fmt in info.get("formats") or []
+        if _is_direct(fmt)
+        and fmt.get("vcodec") == "none"
+        and fmt.get("acodec") not in (None, "none")
+        and (codecs is None or fmt["acodec"].startswith(codecs))
+        and _format_size(fmt) <= max_bytes
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda fmt: fmt.get("abr") or fmt.get("tbr") or 0)
+
+
+def pick_video_format(info, height, max_bytes):
+    # Готовый MP4 со звуком в лучшем доступном качестве не выше height.
+    # Если лучшее качество есть только раздельными потоками — нужен remux,
+    # и потоковый режим не подходит.
+    formats = info.get("formats") or []
+    heights = [
+        fmt.get("height") or 0 for fmt in formats
+        if fmt.get("vcodec") not in (None, "none") and (fmt.get("height") or 0) <= height
+    ]
+    if not heights:
+        return None
+    best_height = max(heights)
+    candidates = [
+        fmt for fmt in formats
+        if _is_direct(fmt)
+        and fmt.get("ext") == "mp4"
+        and fmt.get("vcodec") not in (None, "none")
+        and fmt.get("acodec") not in (None, "none")
+        and fmt.get("height") == best_height
+        and 0 < _format_size(fmt) <= max_bytes
+    ]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda fmt: fmt.get("tbr") or 0)
+
+
+def iter_http(url, headers=None, chunk_size=HTTP_CHUNK_SIZE, progress=None):
+    # Кусками по chunk_size через Range: без этого YouTube режет скорость
+    started = time.monotonic()
+    start = 0
+    total = None
+    while total is None or start < total:
+        end = start + chunk_size - 1
+        request = urllib.request.Request(url, headers={**(headers or {}), "Range": f"bytes={start}-{end}"})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            content_range = response.headers.get("Content-Range")
+            if content_range and "/" in content_range:
+                total = int(content_range.rsplit("/", 1)[1])
+            received = 0
+            while True:
+                block = response.read(READ_SIZE)
+                if not block:
+                    break
+                received += len(block)
+                if progress is not None:
+                    progress.download(start + received, total, started=started)
+                yield block
+        if total is None or not received:
+            # Сервер отдал файл целиком без Range
+            return
+        start += received
+
+
+def stream_file(fmt, max_bytes, progress=None):
+    # Готовый файл (MP4) целиком в память
+    started = time.monotonic()
+    first_byte = None
+    data = bytearray()
+    for block in iter_http(fmt["url"], fmt.get("http_headers"), progress=progress):
+        if first_byte is None:
+            first_byte = time.monotonic() - started
+        data += block
+        if len(data) > max_bytes:
+            raise ValueError("Файл больше лимита потокового режима")
+    return {
+        "data": bytes(data),
+        "stats": _stats(started, first_byte, len(data), "copy"),
+    }
+
+
+def stream_mp3(fmt, title, artist, bitrate="192", max_bytes=None, duration=None, progress=None):
+    # Исходная дорожка -> stdin ffmpeg -> MP3 с тегами из stdout.
+    # Загрузка и конвертация идут одновременно, поэтому прогресс берём
+    # у ffmpeg (-progress в stderr): сколько секунд аудио уже готово.
+    # Обложку добавляет main.py (tagging.tag_data) — ту же, что в кэше медиа.
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostats",
+            "-progress", "pipe:2",
+            "-i", "pipe:0",
+            "-vn", "-c:a", "libmp3lame", "-b:a", f"{bitrate}k",
+            "-id3v2_version", "3",
+            "-metadata", f"title={title}",
+            "-metadata", f"artist={artist}",
+            "-f", "mp3", "pipe:1",
+        ],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+
+    feed_error = []
+
+    def feed():
+        try:
+            for block in iter_http(fmt["url"], fmt.get("http_headers")):
+                process.stdin.write(block)
+        except Exception as e:
+            feed_error.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    feeder = threading.Thread(target=feed, name="stream-feed", daemon=True)
+    feeder.start()
+
+    stderr = []
+
+    def read_stderr():
+        for raw_line in process.stderr:
+            line = raw_line.decode(errors="replace").strip()
+            key, sep, value = line.partition("=")
+            if key == "out_time_us":
+                if progress is not None and duration and value.isdigit():
+                    progress.transcode(int(value) / 1_000_000, duration)
+            elif line and not (sep and (key in PROGRESS_KEYS or key.startswith("stream_"))):
+                stderr.append(line)
+
+    stderr_reader = threading.Thread(target=read_stderr, name="stream-ffmpeg", daemon=True)
+    stderr_reader.start()
+
+    first_byte = None
+    data = bytearray()
+    try:
+        while True:
+            block = process.stdout.read(READ_SIZE)
+            if not block:
+                break
+            if first_byte is None:
+                first_byte = time.monotonic() - started
+            data += block
+            if max_bytes and len(data) > max_bytes:
+                raise ValueError("Файл больше лимита потокового режима")
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.wait()
+        feeder.join()
+        stderr_reader.join()
+
+    if process.returncode != 0 or feed_error:
+        message = "\n".join(stderr).strip()
+        raise RuntimeError(message or str(feed_error[0]))
+
+    return {
+        "data": bytes(data),
+        "stats": _stats(started, first_byte, len(data), "transcode"),
+    }
+
+
+def _stats(started, first_byte, size, path):
+    # ttfb — время до первого байта результата; upload_start — когда файл
+    # готов к отправке в Telegram. Диск в этом режиме не используется.
+    elapsed = time.monotonic() - started
+    return {
+        "mode": "stream",
+        "ttfb": first_byte or 0.0,
+        "upload_start": elapsed,
+        "peak_disk": 0,
+        "size": size,
+        "path": path,   # см. formats.py
+        # загрузка и конвертация идут одновременно — это один этап
+        "timings": {"stream": elapsed},
+    }
@@ -0,0 +1,175 @@
+# tagging.py
+# Запись ID3v2-тегов без разбора аудио: читается только сам тег в начале
+# файла. Тег пишется с запасом (padding), поэтому следующая правка
+# помещается на старое место и переписывает несколько килобайт, а не весь
+# файл. Весь файл переписывается, только если новый тег не влез.
+# Функции блокирующие — из event loop их вызывают через run_in_executor.
+import io
+import os
+import shutil
+import struct
+import urllib.request
+
+# Запас после фреймов при перезаписи файла: хватает на правку названия/автора
+DEFAULT_PADDING = 4096
+COPY_CHUNK = 1024 * 1024
+
+# Обложка YouTube 480x360 в JPEG, обычно 20–40 КБ
+COVER_URL = "https://i.ytimg.com/vi/{}/hqdefault.jpg"
+MAX_COVER_BYTES = 1024 * 1024
+
+
+def _synchsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _to_synchsafe(value):
+    return bytes(((value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F))
+
+
+def _read_tag(f):
+    # (версия, размер тега вместе с заголовком, [(id, флаги, данные)]).
+    # Фреймы старых версий и тегов с unsynchronisation не сохраняем —
+    # только освобождаем их место.
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 3, 0, []
+    version, flags = header[3], header[5]
+    region = 10 + _synchsafe(header[6:10])
+    if version == 4 and flags & 0x10:
+        region += 10  # footer
+    if version not in (3, 4) or flags & 0x80:
+        return 3, region, []
+
+    body = f.read(region - 10)
+    pos = 0
+    if flags & 0x40:
+        # Расширенный заголовок: в 2.3 размер без себя, в 2.4 — synchsafe с собой
+        if version == 3:
+            pos = 4 + struct.unpack(">I", body[:4])[0]
+        else:
+            pos = _synchsafe(body[:4])
+
+    frames = []
+    while pos + 10 <= len(body) and body[pos] != 0:
+        frame_id = body[pos:pos + 4]
+        size_bytes = body[pos + 4:pos + 8]
+        size = _synchsafe(size_bytes) if version == 4 else struct.unpack(">I", size_bytes)[0]
+        if pos + 10 + size > len(body):
+            break
+        frames.append((frame_id, body[pos + 8:pos + 10], body[pos + 10:pos + 10 + size]))
+        pos += 10 + size
+    return version, region, frames
+
+
+def _frame(version, frame_id, flags, data):
+    size = _to_synchsafe(len(data)) if version == 4 else struct.pack(">I", len(data))
+    return frame_id + size + flags + data
+
+
+def _text(version, value):
+    # Латиница — ISO-8859-1, остальное — UTF-8 (2.4) или UTF-16 с BOM (2.3)
+    try:
+        return b"\x00" + value.encode("latin-1")
+    except UnicodeEncodeError:
+        if version == 4:
+            return b"\x03" + value.encode("utf-8")
+        return b"\x01" + value.encode("utf-16")
+
+
+def _picture(data):
+    mime = b"image/png" if data[:8] == b"\x89PNG\r\n\x1a\n" else b"image/jpeg"
+    # кодировка, MIME, тип 3 (передняя обложка), пустое описание, картинка
+    return b"\x00" + mime + b"\x00\x03\x00" + data
+
+
+def _body(version, frames, updates):
+    # updates — {id фрейма: данные или None (удалить)}
+    frames = [frame for frame in frames if frame[0] not in updates]
+    for frame_id, data in updates.items():
+        if data is not None:
+            frames.append((frame_id, b"\x00\x00", data))
+    return b"".join(_frame(version, *frame) for frame in frames)
+
+
+def _updates(version, title, artist, cover):
+    # Фреймы для write_tags/tag_data
+    updates = {}
+    if title:
+        updates[b"TIT2"] = _text(version, title)
+    if artist:
+        updates[b"TPE1"] = _text(version, artist)
+    if cover:
+        updates[b"APIC"] = _picture(cover)
+    return updates
+
+
+def _write(path, updates, padding, min_size=0):
+    with open(path, "r+b") as f:
+        version, region, frames = _read_tag(f)
+        body = _body(version, frames, updates)
+
+        if 10 + len(body) <= region and region >= min_size:
+            # Влезает в старое место: переписываем только тег
+            f.seek(0)
+            f.write(b"ID3" + bytes((version, 0, 0)) + _to_synchsafe(region - 10))
+            f.write(body)
+            f.write(b"\x00" * (region - 10 - len(body)))
+            return True
+
+    size = max(10 + len(body) + padding, min_size)
+    tmp_path = path + ".tagtmp"
+    try:
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            dst.write(b"ID3" + bytes((version, 0, 0)) + _to_synchsafe(size - 10))
+            dst.write(body)
+            dst.write(b"\x00" * (size - 10 - len(body)))
+            src.seek(region)
+            shutil.copyfileobj(src, dst, COPY_CHUNK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return False
+
+
+def write_tags(path, title=None, artist=None, cover=None, padding=DEFAULT_PADDING):
+    # Пустые значения не трогают существующие фреймы. True — записано на
+    # месте, False — файл пришлось переписать.
+    with open(path, "rb") as f:
+        version = _read_tag(f)[0]
+    return _write(path, _updates(version, title, artist, cover), padding)
+
+
+def tag_data(data, title=None, artist=None, cover=None, padding=0):
+    # То же для MP3 в памяти (из streaming.stream_mp3): новые байты с тегом
+    version, region, frames = _read_tag(io.BytesIO(data))
+    body = _body(version, frames, _updates(version, title, artist, cover))
+    header = b"ID3" + bytes((version, 0, 0)) + _to_synchsafe(len(body) + padding)
+    return header + body + b"\x00" * padding + data[region:]
+
+
+def reserve(path, size, cover=None):
+    # Места под тег не меньше size байт (один раз переписывает файл), чтобы
+    # следующие write_tags этого файла и его копий шли на месте. cover
+    # записывается заодно: копии получают обложку без повторной загрузки.
+    updates = {b"APIC": _picture(cover)} if cover else {}
+    return _write(path, updates, DEFAULT_PADDING if cover else 0, size)
+
+
+def read_tags(path):
+    # {id фрейма: данные} — для проверок и бенчмарка
+    with open(path, "rb") as f:
+        return {frame_id.decode("latin-1"): data for frame_id, _, data in _read_tag(f)[2]}
+
+
+def fetch_cover(video_id, timeout=10):
+    if not video_id:
+        return None
+    try:
+        with urllib.request.urlopen(COVER_URL.format(video_id), timeout=timeout) as response:
+            return response.read(MAX_COVER_BYTES)
+    except OSError as e:
+        print(f"Cover error: {e}")
+        return None
@@ -0,0 +1,103 @@
+# worker.py
+# Процессы, которые выполняют задачи из общей очереди (JOB_BROKER = "sqlite"
+# в config.py): скачивание, конвертация и отправка — тем же кодом, что и в
+# main.py, но каждый процесс со своим подключением к Telegram, которое не
+# принимает апдейты (их принимает только main.py). Общее состояние — в
+# users.db (кэш file_id, индекс медиакэша, история) и в downloads/cache.
+#
+#   python worker.py [--workers N] [--jobs M]
+import argparse
+import asyncio
+import multiprocessing
+import signal
+import sys
+import time
+from pyrogram import Client
+from config import (
+    API_ID, API_HASH, BOT_TOKEN, JOB_BROKER, JOB_DB_PATH, JOB_LEASE,
+    WORKER_PROCESSES, WORKER_JOBS, METRICS_HOST, METRICS_PORT,
+)
+from database import init_db, run_db
+import downloader
+import jobqueue
+import metrics
+
+# Выполненные задачи храним сутки (для разбора), потом удаляем
+PURGE_AFTER = 24 * 60 * 60
+
+
+async def run_worker(index, jobs):
+    # Код бота импортируется только в дочернем процессе: соединение с
+    # users.db и пулы у каждого процесса свои
+    import main as app
+
+    broker = jobqueue.SQLiteBroker(JOB_DB_PATH)
+
+    client = Client(
+        f"youtube_downloader_worker_{index}",
+        api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN,
+        no_updates=True
+    )
+
+    handlers = app.job_handlers(client)
+
+    if METRICS_PORT:
+        # Метрики каждого воркера на своём порту: METRICS_PORT + 1 + index
+        metrics.start_http_server(METRICS_PORT + 1 + index, METRICS_HOST)
+    if index == 0:
+        broker.purge(PURGE_AFTER)
+
+    db_ready = asyncio.ensure_future(run_db(init_db))
+    await client.start()
+    await db_ready
+    asyncio.get_running_loop().run_in_executor(None, downloader.warm_up)
+    print(f"Worker {index} started")
+    try:
+        await jobqueue.consume(broker, handlers, f"worker-{index}", jobs, lease=JOB_LEASE)
+    finally:
+        await client.stop()
+
+
+def worker_main(index, jobs):
+    asyncio.run(run_worker(index, jobs))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=WORKER_PROCESSES)
+    parser.add_argument("--jobs", type=int, default=WORKER_JOBS)
+    args = parser.parse_args()
+    if JOB_BROKER != "sqlite":
+        raise SystemExit('worker.py нужен только при JOB_BROKER = "sqlite" в config.py')
+
+    # spawn, а не fork: дочерний процесс начинает с чистого интерпретатора
+    context = multiprocessing.get_context("spawn")
+
+    # Не daemon: воркеру с DOWNLOAD_POOL = "process" нужны свои дочерние
+    # процессы. Поэтому останавливаем их сами — и по Ctrl+C, и по SIGTERM.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Упавший процесс перезапускаем; его задачу после JOB_LEASE заберёт любой воркер
+    processes = {}
+    try:
+        while True:
+            for index in range(args.workers):
+                process = processes.get(index)
+                if process is None or not process.is_alive():
+                    if process is not None:
+                        print(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    process = context.Process(target=worker_main, args=(index, args.jobs))
+                    process.start()
+                    processes[index] = process
+            time.sleep(5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
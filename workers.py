@@ -0,0 +1,153 @@
+# workers.py
+# Пул для блокирующих задач (yt-dlp, ffmpeg), чтобы хендлеры pyrogram
+# не останавливали event loop. Задачи ждут в общей FIFO-очереди и
+# запускаются, когда есть свободный воркер и у пользователя не превышен лимит.
+import asyncio
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+
+# Позицию в очереди пользователю обновляем не чаще раза за столько секунд
+NOTIFY_INTERVAL = 5.0
+
+
+class _Job:
+    __slots__ = ("user_id", "started", "limit", "moved")
+
+    def __init__(self, user_id, started, limit):
+        self.user_id = user_id
+        self.started = started
+        self.limit = limit
+        # Очередь сдвинулась: позиция могла измениться
+        self.moved = asyncio.Event()
+
+
+class DownloadQueue:
+    def __init__(self, max_workers=4, per_user=1, mode="thread", name="download", notify_interval=NOTIFY_INTERVAL):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown pool mode: {mode}")
+        self.max_workers = max_workers
+        self.per_user = per_user
+        self.mode = mode
+        self.name = name
+        self.notify_interval = notify_interval
+        self._pool = None
+        self._waiting = deque()
+        self._active = 0
+        self._active_per_user = defaultdict(int)
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.mode == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.name
+                )
+        return self._pool
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
+
+    def position(self, job):
+        # Позиция в очереди, начиная с 1 (0 — задача уже запущена)
+        for index, waiting_job in enumerate(self._waiting, start=1):
+            if waiting_job is job:
+                return index
+        return 0
+
+    def _can_start(self, job):
+        return self._active_per_user[job.user_id] < (job.limit or self.per_user)
+
+    def _dispatch(self):
+        # Запускаем задачи по порядку; задачи пользователей, упёршихся
+        # в свой лимит, пропускаем, но оставляем на своём месте.
+        if self._active >= self.max_workers:
+            return
+        moved = False
+        for job in list(self._waiting):
+            if self._active >= self.max_workers:
+                break
+            if job.started.done() or not self._can_start(job):
+                continue
+            self._waiting.remove(job)
+            self._active += 1
+            self._active_per_user[job.user_id] += 1
+            job.started.set_result(True)
+            job.moved.set()
+            moved = True
+        if moved:
+            self._moved()
+
+    def _moved(self):
+        for job in self._waiting:
+            job.moved.set()
+
+    async def _notify(self, job, on_queued):
+        # Позиция в очереди: сразу, потом при каждом сдвиге, но не чаще
+        # notify_interval. Ошибка уведомления (FloodWait, удалённое
+        # сообщение) задачу не отменяет.
+        reported = None
+        while True:
+            position = self.position(job)
+            if not position:
+                return
+            if position != reported:
+                reported = position
+                try:
+                    await on_queued(position)
+                except Exception as e:
+                    print(f"Queue notify error: {e}")
+            await asyncio.sleep(self.notify_interval)
+            await job.moved.wait()
+            job.moved.clear()
+
+    def _release(self, user_id):
+        self._active -= 1
+        self._active_per_user[user_id] -= 1
+        if not self._active_per_user[user_id]:
+            del self._active_per_user[user_id]
+        self._dispatch()
+
+    async def run(self, user_id, fn, *args, on_queued=None, limit=None, **kwargs):
+        # limit — свой лимит одновременных задач пользователя вместо per_user
+        # (пакетная загрузка идёт в несколько потоков)
+        loop = asyncio.get_running_loop()
+        job = _Job(user_id, loop.create_future(), limit)
+        self._waiting.append(job)
+        self._dispatch()
+
+        notifier = None
+        if not job.started.done() and on_queued is not None:
+            notifier = asyncio.ensure_future(self._notify(job, on_queued))
+        try:
+            await job.started
+        except BaseException:
+            # Отмена, пока задача ждала в очереди
+            if job.started.done() and not job.started.cancelled():
+                self._release(user_id)
+            else:
+                job.started.cancel()
+                if job in self._waiting:
+                    self._waiting.remove(job)
+                    self._moved()
+            raise
+        finally:
+            if notifier is not None:
+                notifier.cancel()
+
+        try:
+            return await loop.run_in_executor(self._get_pool(), partial(fn, *args, **kwargs))
+        finally:
+            self._release(user_id)
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None